@@ -0,0 +1,60 @@
+# src/etl/_db.py
+"""
+Shared DuckDB connection for the ETL scripts.
+
+get_con() opens finance.duckdb once per process and applies the session
+PRAGMAs in one place, instead of every script calling duckdb.connect() itself.
+
+Env:
+- DUCKDB_PATH: explicit database file (wins if set)
+- DATA_DIR: folder where finance.duckdb lives otherwise
+- DUCKDB_THREADS: worker threads (default: all cores)
+- DUCKDB_MEMORY_LIMIT: e.g. "8GB" (default: half of physical RAM when psutil is available)
+- DUCKDB_TEMP_DIR: spill folder for large sorts/joins (default: DuckDB's <db file>.tmp, i.e. inside DATA_DIR)
+"""
+from __future__ import annotations
+import os
+from pathlib import Path
+import duckdb
+from dotenv import load_dotenv
+
+load_dotenv()
+
+DATA_DIR = Path(os.getenv("DATA_DIR", r"C:\Users\jo136\OneDrive\FinanceData"))
+DB_PATH  = Path(os.getenv("DUCKDB_PATH", DATA_DIR / "finance.duckdb"))
+
+_CON: duckdb.DuckDBPyConnection | None = None
+
+def _memory_limit() -> str | None:
+    """DUCKDB_MEMORY_LIMIT, else 50% of physical RAM (psutil optional), else DuckDB's default."""
+    if os.getenv("DUCKDB_MEMORY_LIMIT"):
+        return os.getenv("DUCKDB_MEMORY_LIMIT")
+    try:
+        import psutil
+    except ImportError:
+        return None
+    gb = max(1, int(psutil.virtual_memory().total * 0.5) // (1024 ** 3))
+    return f"{gb}GB"
+
+def get_con(read_only: bool = False) -> duckdb.DuckDBPyConnection:
+    """
+    Return the process-wide connection, opening and tuning it on first use.
+    read_only (honoured on that first call) skips the write lock and WAL, so quick looks
+    (peek.py, SELECTs in run_sql.py) can run alongside each other.
+    """
+    global _CON
+    if _CON is None:
+        DB_PATH.parent.mkdir(parents=True, exist_ok=True)
+        _CON = duckdb.connect(str(DB_PATH), read_only=read_only)
+        threads = int(os.getenv("DUCKDB_THREADS") or os.cpu_count() or 4)
+        _CON.execute(f"PRAGMA threads={threads}")
+        mem = _memory_limit()
+        if mem:
+            _CON.execute(f"PRAGMA memory_limit='{mem}'")
+        # e.g. a local disk, so spill files from big MERGE / window sorts don't sit in a synced DATA_DIR
+        if os.getenv("DUCKDB_TEMP_DIR"):
+            _CON.execute(f"PRAGMA temp_directory='{Path(os.environ['DUCKDB_TEMP_DIR']).as_posix()}'")
+        _CON.execute("PRAGMA enable_object_cache=true")
+        # Rollups never rely on physical row order; lets aggregates/inserts run fully parallel
+        _CON.execute("PRAGMA preserve_insertion_order=false")
+    return _CON
@@ -0,0 +1,138 @@
+# src/etl/_kernels.py
+"""
+Numeric kernels for the retirement projection, plus the literal-substring scan used by
+normalize_transactions' category rules.
+
+numba is optional: when it is installed the kernels are JIT-compiled, otherwise
+the same code runs as plain Python/NumPy (fine at household sizes).
+
+Every kernel uses cache=True, so the compiled machine code is written next to this
+file (__pycache__) and reused by later runs instead of paying the JIT cost each time.
+fastmath is deliberately off: it may reassociate the compounding products and change
+the exported values.
+"""
+from __future__ import annotations
+import numpy as np
+
+try:
+    from numba import njit, prange
+    HAVE_NUMBA = True
+except ImportError:  # numba not installed -> run the kernels as regular Python
+    HAVE_NUMBA = False
+    prange = range
+
+    def njit(*args, **kwargs):
+        if args and callable(args[0]):
+            return args[0]
+        return lambda fn: fn
+
+# Shared JIT options (bounds checks are numba's default-off; stated so nobody flips it by accident)
+JIT_OPTS = dict(cache=True, boundscheck=False)
+
+
+@njit(parallel=True, **JIT_OPTS)
+def rollforward(start_values, contribs, g):
+    """
+    Per-account roll-forward: V[t] = (V[t-1] + contrib[t]) * (1 + g), V[0] = start value.
+    start_values: (n_accounts,), contribs: (n_accounts, n_years) -> (n_accounts, n_years)
+    """
+    n_acc, n_years = contribs.shape
+    out = np.empty((n_acc, n_years))
+    for i in prange(n_acc):
+        v = start_values[i]
+        out[i, 0] = v
+        for t in range(1, n_years):
+            v = (v + contribs[i, t]) * (1.0 + g)
+            out[i, t] = v
+    return out
+
+
+@njit(**JIT_OPTS)
+def inflation_curve(n, r):
+    """(1 + r) ** k for k = 0..n-1 as a running product (no per-element pow)."""
+    arr = np.full(n, 1.0 + r)
+    if n > 0:
+        arr[0] = 1.0
+    return np.cumprod(arr)
+
+
+@njit(parallel=True, **JIT_OPTS)
+def _expand_fused(starts, ends, vals, inflate, base_year, r):
+    n = starts.shape[0]
+    n_years = np.maximum(ends - starts + 1, 0)
+    offsets = np.zeros(n + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum(n_years)
+    out_row = np.empty(offsets[n], dtype=np.int64)
+    out_year = np.empty(offsets[n], dtype=np.int64)
+    out_val = np.empty(offsets[n])
+    f = 1.0 + r
+    for i in prange(n):
+        v = vals[i]
+        if inflate[i]:
+            # today's dollars -> nominal at start year
+            for _ in range(max(0, starts[i] - base_year)):
+                v *= f
+        o = offsets[i]
+        for k in range(n_years[i]):
+            out_row[o + k] = i
+            out_year[o + k] = starts[i] + k
+            out_val[o + k] = v
+            if inflate[i]:
+                v *= f
+    return out_row, out_year, out_val
+
+
+def _expand_numpy(starts, ends, vals, inflate, base_year, r):
+    n_years = np.maximum(ends - starts + 1, 0)
+    out_row = np.repeat(np.arange(len(starts)), n_years)
+    # position of each output row within its assumption's year range
+    idx = np.arange(n_years.sum()) - np.repeat(np.cumsum(n_years) - n_years, n_years)
+    out_year = starts[out_row] + idx
+    # (1 + r) ** k looked up from one running-product curve instead of a pow per element
+    pre_k = np.maximum(0, starts[out_row] - base_year)
+    curve = inflation_curve(int(max(pre_k.max(initial=0), idx.max(initial=0))) + 1, r)
+    out_val = np.where(inflate[out_row], vals[out_row] * curve[pre_k] * curve[idx], vals[out_row])
+    return out_row, out_year, out_val
+
+
+def expand_timed_rows(starts, ends, vals, inflate, base_year, r):
+    """
+    Explode assumptions into one row per year in [start, end].
+    Inflated rows are brought from today's dollars to start-year nominal, then grow by (1 + r)
+    each year; others repeat their value. Returns (source row index, year, value) arrays.
+    One fused pass under numba; vectorized NumPy otherwise.
+    """
+    if HAVE_NUMBA:
+        return _expand_fused(starts, ends, vals, inflate, base_year, r)
+    return _expand_numpy(starts, ends, vals, inflate, base_year, r)
+
+
+@njit(parallel=True, **JIT_OPTS)
+def first_literal_match(text, text_offsets, pats, pat_offsets, pat_pos, none):
+    """
+    Per row, the rule position of the first pattern (in the given order) found in its text.
+    text / pats are concatenated UTF-8 bytes sliced by their offsets arrays (len n + 1);
+    rows without a hit get `none`. Only worth calling under numba: the pure Python fallback
+    is a byte-by-byte loop.
+    """
+    n = text_offsets.shape[0] - 1
+    out = np.full(n, none, dtype=np.int64)
+    for i in prange(n):
+        s0, s1 = text_offsets[i], text_offsets[i + 1]
+        for k in range(pat_pos.shape[0]):
+            p0, p1 = pat_offsets[k], pat_offsets[k + 1]
+            m = p1 - p0
+            found = False
+            for j in range(s0, s1 - m + 1):
+                ok = True
+                for t in range(m):
+                    if text[j + t] != pats[p0 + t]:
+                        ok = False
+                        break
+                if ok:
+                    found = True
+                    break
+            if found:
+                out[i] = pat_pos[k]
+                break
+    return out
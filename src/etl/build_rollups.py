@@ -1,22 +1,23 @@
 # src/etl/build_rollups.py
 from __future__ import annotations
+import hashlib
 import os
+import sys
 from pathlib import Path
-from dotenv import load_dotenv
 import duckdb
 
+from _db import DATA_DIR, get_con
+
 # -------------------------
 # ENV / PATHS
 # -------------------------
-load_dotenv()
-
-DATA_DIR = Path(os.getenv("DATA_DIR", r"C:\Users\jo136\OneDrive\FinanceData"))
-DB_ENV = os.getenv("DUCKDB_PATH")
-DB_PATH = Path(DB_ENV) if DB_ENV else (DATA_DIR / "finance.duckdb")
 EXPORTS_DIR = DATA_DIR / "exports"
 EXPORTS_DIR.mkdir(parents=True, exist_ok=True)
 
-con = duckdb.connect(str(DB_PATH))
+# ZSTD is ~20-40% smaller than the default SNAPPY at these sizes; one file per export
+PARQUET_OPTS = "FORMAT PARQUET, COMPRESSION ZSTD, ROW_GROUP_SIZE 100000, PER_THREAD_OUTPUT false"
+
+con = get_con()
 
 # -------------------------
 # HELPERS
@@ -50,12 +51,101 @@ def list_columns(con: duckdb.DuckDBPyConnection, table: str) -> list[str]:
 
 def safe_copy(table: str, filename: str):
     if has_table(con, table):
+        if export_is_current(filename):
+            print(f"SKIP export {table}: sources unchanged")
+            return
         dst = (EXPORTS_DIR / filename).as_posix()
-        con.execute(f"COPY {table} TO '{dst}' (FORMAT PARQUET)")
+        con.execute("BEGIN TRANSACTION")
+        try:
+            con.execute(f"COPY {table} TO '{dst}' ({PARQUET_OPTS})")
+            mark_export_current(filename)
+            con.execute("COMMIT")
+        except Exception:
+            con.execute("ROLLBACK")
+            raise
         print(f"Exported {table} -> {dst}")
     else:
         print(f"SKIP export {table}: table not found")
 
+# -------------------------
+# INCREMENTAL STATE
+# Each export records a fingerprint (row count + order-independent row hash) of
+# the tables it reads. Unchanged fingerprint + file on disk => skip the COPY.
+# The script's own source and fiscal start are folded in so logic changes still rebuild.
+# Set FORCE_ROLLUPS=1 to rebuild everything.
+# -------------------------
+TXN_SOURCES = ["transactions", "category_rules", "category_overrides", "category_dim"]
+DATE_SOURCES = ["transactions", "budget_monthly", "balance_snapshot", "positions"]
+POS_SOURCES = ["positions", "security_dim", "account_dim"]
+
+EXPORT_SOURCES = {
+    "transactions_with_category.parquet": TXN_SOURCES,
+    "monthly_cashflow.parquet": TXN_SOURCES,
+    "monthly_actuals_by_category.parquet": TXN_SOURCES,
+    "monthly_actuals_by_category_enriched.parquet": TXN_SOURCES,
+    "budget_monthly.parquet": ["budget_monthly"],
+    "category_dim.parquet": ["category_dim"],
+    "security_dim.parquet": ["security_dim"],
+    "month_dim.parquet": DATE_SOURCES,
+    "monthly_net_worth.parquet": ["balance_snapshot", "account_dim"],
+    "monthly_net_worth_by_group.parquet": ["balance_snapshot", "account_dim"],
+    "monthly_allocation.parquet": POS_SOURCES,
+    "allocation_vs_target.parquet": POS_SOURCES + ["target_allocation"],
+    "positions_enriched_export.parquet": POS_SOURCES,
+    "calendar_dim.parquet": DATE_SOURCES,
+}
+
+FORCE_ROLLUPS = os.getenv("FORCE_ROLLUPS", "").strip().lower() in ("1", "true", "yes")
+SCRIPT_HASH = hashlib.sha1(Path(__file__).read_bytes()).hexdigest()[:12]
+
+con.execute("CREATE TABLE IF NOT EXISTS etl_state (key TEXT PRIMARY KEY, value TEXT)")
+
+_fingerprints: dict[str, str] = {}
+
+# Built around CURRENT_DATE when no date source has a date (see CALENDAR below), so they go stale overnight
+TODAY_RELATIVE_EXPORTS = {"calendar_dim.parquet", "month_dim.parquet"}
+DATE_COLUMNS = {"transactions": "date", "budget_monthly": "month",
+                "balance_snapshot": "as_of_date", "positions": "as_of_date"}
+
+def _calendar_today() -> str | None:
+    """CURRENT_DATE if the calendar will be built around today (no dated rows in any source), else None."""
+    for t, c in DATE_COLUMNS.items():
+        if has_table(con, t) and has_column(con, t, c) and \
+                con.execute(f"SELECT 1 FROM {t} WHERE {c} IS NOT NULL LIMIT 1").fetchone():
+            return None
+    return str(con.execute("SELECT CURRENT_DATE").fetchone()[0])
+
+def table_fingerprint(name: str) -> str:
+    if name not in _fingerprints:
+        if has_table(con, name):
+            n, h = con.execute(
+                f"SELECT COUNT(*), COALESCE(SUM(hash(t)), 0)::VARCHAR FROM {name} t"
+            ).fetchone()
+            _fingerprints[name] = f"{name}:{n}:{h}"
+        else:
+            _fingerprints[name] = f"{name}:-"
+    return _fingerprints[name]
+
+def export_fingerprint(filename: str) -> str:
+    parts = [SCRIPT_HASH, f"fs={os.getenv('FISCAL_YEAR_START_MONTH', '1')}"]
+    parts += [table_fingerprint(t) for t in EXPORT_SOURCES.get(filename, [])]
+    if filename in TODAY_RELATIVE_EXPORTS:
+        parts.append(f"today={_calendar_today()}")
+    return "|".join(parts)
+
+def export_is_current(filename: str) -> bool:
+    if FORCE_ROLLUPS or filename not in EXPORT_SOURCES or not (EXPORTS_DIR / filename).exists():
+        return False
+    row = con.execute("SELECT value FROM etl_state WHERE key = ?", [f"export:{filename}"]).fetchone()
+    return row is not None and row[0] == export_fingerprint(filename)
+
+def mark_export_current(filename: str) -> None:
+    if filename in EXPORT_SOURCES:
+        con.execute(
+            "INSERT INTO etl_state VALUES (?, ?) ON CONFLICT (key) DO UPDATE SET value = excluded.value",
+            [f"export:{filename}", export_fingerprint(filename)],
+        )
+
 # -------------------------
 # Ensure rules tables exist (from CSVs) if missing
 # -------------------------
@@ -111,6 +201,11 @@ if not has_table(con, "category_rules"):
         con.execute("CREATE TABLE category_rules AS SELECT * FROM read_csv_auto(?, HEADER=TRUE)", [str(catrules_csv)])
         print("Loaded category_rules from CSV")
 
+# No-op run: every export is on disk and its sources are unchanged since it was written
+if all(export_is_current(f) for f in EXPORT_SOURCES):
+    print("All rollup sources unchanged since last export; nothing to do (FORCE_ROLLUPS=1 to rebuild).")
+    sys.exit(0)
+
 # -------------------------
 # MONTH DIM (union of sources present)
 # -------------------------
@@ -146,9 +241,13 @@ else:
 # Rules override any default category; single category column; no is_transfer in view
 # -------------------------
 if has_table(con, "transactions"):
+    # One catalog read; every column probe below is a set lookup
+    tx_cols_all = list_columns(con, "transactions")
+    txn_cols = set(tx_cols_all)
+
     # Candidate description fields (use ALL via COALESCE so rules still match if one is null)
     desc_candidates = [c for c in ("clean_description","description","memo","payee","name")
-                       if has_column(con, "transactions", c)]
+                       if c in txn_cols]
     # Build a robust desc_src = lower(coalesce(...))
     if desc_candidates:
         coalesce_expr = "COALESCE(" + ", ".join([f"t.{c}" for c in desc_candidates]) + ", '')"
@@ -158,17 +257,17 @@ if has_table(con, "transactions"):
     # ---------- DEDUPE: collapse monthly-export / pending+posted duplicates ----------
     acct_candidates = [c for c in ("account_id","account","account_name","institution",
                                    "card_last4","account_last4","source","source_file")
-                       if has_column(con, "transactions", c)]
+                       if c in txn_cols]
     account_expr = ("COALESCE(" + ", ".join([f"t.{c}" for c in acct_candidates]) + ", '')"
                     if acct_candidates else "''")
 
     date_candidates = [c for c in ("post_date","transaction_date","date")
-                       if has_column(con, "transactions", c)]
+                       if c in txn_cols]
     date_expr = ("COALESCE(" + ", ".join([f"t.{c}" for c in date_candidates]) + ")"
                  if date_candidates else "DATE '1970-01-01'")
 
-    has_amt_cents = has_column(con, "transactions", "amount_cents")
-    has_amt       = has_column(con, "transactions", "amount")
+    has_amt_cents = "amount_cents" in txn_cols
+    has_amt       = "amount" in txn_cols
     amount_key    = ("ABS(t.amount_cents)" if has_amt_cents
                      else ("CAST(ROUND(ABS(t.amount) * 100) AS BIGINT)" if has_amt else "0::BIGINT"))
 
@@ -180,13 +279,13 @@ if has_table(con, "transactions"):
     # status/“pending” rank **without** table alias (these are columns from base)
     status_rank = (
         ("CASE WHEN LOWER(status) IN ('posted','complete','final','settled') THEN 0 ELSE 1 END"
-         if has_column(con, "transactions", "status") else "0")
+         if "status" in txn_cols else "0")
         + " + CASE WHEN desc_norm LIKE '%pending%' THEN 1 ELSE 0 END"
     )
 
     # tie-breaker on ids (bare column names; no t.)
     txn_id_candidates = [c for c in ("txn_id","transaction_id","reference_id","id")
-                         if has_column(con, "transactions", c)]
+                         if c in txn_cols]
     txn_id_order = ", ".join(txn_id_candidates) if txn_id_candidates else ""
 
     con.execute(f"""
@@ -216,18 +315,15 @@ if has_table(con, "transactions"):
     print("Built transactions_deduped (deduped by account+date+amount+desc)")
 
     # Columns to expose from transactions (drop duplicates/noise)
-    tx_cols_all = [r[0] for r in con.execute(
-        "SELECT column_name FROM information_schema.columns WHERE table_name = 'transactions' ORDER BY ordinal_position"
-    ).fetchall()]
     drop_cols = {"subcategory", "is_transfer"}  # exclude these from the view
     tx_cols_no_cat = [c for c in tx_cols_all if c not in (drop_cols | {"category"})]
 
-    has_tx_category = has_column(con, "transactions", "category")
+    has_tx_category = "category" in txn_cols
 
     # Additions for manual overrides
-    has_tx_date    = has_column(con, "transactions", "date")
-    has_amt_cents  = has_column(con, "transactions", "amount_cents")
-    has_amt        = has_column(con, "transactions", "amount")
+    has_tx_date    = "date" in txn_cols
+    has_amt_cents  = "amount_cents" in txn_cols
+    has_amt        = "amount" in txn_cols
 
     overrides_available = (
         has_table(con, "category_overrides") and
@@ -514,7 +610,14 @@ else:
 # NET WORTH ROLLUPS
 # -------------------------
 if has_table(con, "balance_snapshot") and has_table(con, "account_dim"):
-    con.execute("""
+    if has_column(con, "balance_snapshot", "balance_cents"):
+        bal_cents = "b.balance_cents"
+    else:
+        # Legacy dollar `balance` column (load_accounts_and_balances.py not re-run since the cents change)
+        bal_cents = "CAST(ROUND(b.balance * 100) AS BIGINT)"
+        print("WARN balance_snapshot has no balance_cents column (legacy schema); converting balance on the fly. "
+              "Re-run load_accounts_and_balances.py to migrate it to cents.")
+    con.execute(f"""
         CREATE OR REPLACE VIEW balances_enriched AS
         SELECT
           date_trunc('month', b.as_of_date)::DATE AS month_date,
@@ -528,9 +631,9 @@ if has_table(con, "balance_snapshot") and has_table(con, "account_dim"):
           a.include_networth,
           a.include_liquid,
           CASE WHEN LOWER(COALESCE(a.type,'')) = 'liability'
-               THEN -1.0 * CAST(b.balance AS DOUBLE)
-               ELSE CAST(b.balance AS DOUBLE)
-          END AS balance_norm
+               THEN -{bal_cents}
+               ELSE {bal_cents}
+          END AS balance_norm_cents
         FROM balance_snapshot b
         LEFT JOIN account_dim a USING(account_id);
     """)
@@ -538,11 +641,11 @@ if has_table(con, "balance_snapshot") and has_table(con, "account_dim"):
         CREATE OR REPLACE TABLE monthly_net_worth AS
         SELECT
           month,
-          SUM(CASE WHEN include_networth THEN balance_norm ELSE 0 END)                           AS net_worth,
-          SUM(CASE WHEN include_networth AND balance_norm > 0 THEN balance_norm ELSE 0 END)     AS assets,
-          SUM(CASE WHEN include_networth AND balance_norm < 0 THEN balance_norm ELSE 0 END)     AS liabilities,
-          SUM(CASE WHEN include_liquid    THEN balance_norm ELSE 0 END)                          AS liquid_net_worth,
-          SUM(CASE WHEN include_networth AND liquidity IN ('investable') THEN balance_norm ELSE 0 END) AS investable_assets
+          CAST(SUM(CASE WHEN include_networth THEN balance_norm_cents ELSE 0 END) / 100.0 AS DOUBLE)                       AS net_worth,
+          CAST(SUM(CASE WHEN include_networth AND balance_norm_cents > 0 THEN balance_norm_cents ELSE 0 END) / 100.0 AS DOUBLE) AS assets,
+          CAST(SUM(CASE WHEN include_networth AND balance_norm_cents < 0 THEN balance_norm_cents ELSE 0 END) / 100.0 AS DOUBLE) AS liabilities,
+          CAST(SUM(CASE WHEN include_liquid    THEN balance_norm_cents ELSE 0 END) / 100.0 AS DOUBLE)                      AS liquid_net_worth,
+          CAST(SUM(CASE WHEN include_networth AND liquidity IN ('investable') THEN balance_norm_cents ELSE 0 END) / 100.0 AS DOUBLE) AS investable_assets
         FROM balances_enriched
         GROUP BY 1
         ORDER BY 1;
@@ -552,7 +655,7 @@ if has_table(con, "balance_snapshot") and has_table(con, "account_dim"):
         SELECT
           month,
           acct_group,
-          SUM(CASE WHEN include_networth THEN balance_norm ELSE 0 END) AS value
+          CAST(SUM(CASE WHEN include_networth THEN balance_norm_cents ELSE 0 END) / 100.0 AS DOUBLE) AS value
         FROM balances_enriched
         GROUP BY 1,2
         ORDER BY 1,2;
@@ -688,6 +791,22 @@ if has_table(con, "positions"):
 else:
     print("SKIP allocation: positions table not found")
 
+# -------------------------
+# BUDGET (stored in cents; reporting view keeps the dollar `amount` column)
+# -------------------------
+if has_table(con, "budget_monthly") and has_column(con, "budget_monthly", "amount_cents"):
+    con.execute("""
+        CREATE OR REPLACE VIEW budget_monthly_report AS
+        SELECT month, category, amount_cents / 100.0 AS amount
+        FROM budget_monthly
+    """)
+    print("Built budget_monthly_report")
+elif has_table(con, "budget_monthly"):
+    # Legacy dollar-amount schema (load_rules.py not re-run since the cents change): export it as-is
+    con.execute("CREATE OR REPLACE VIEW budget_monthly_report AS SELECT * FROM budget_monthly")
+    print("WARN budget_monthly has no amount_cents column (legacy schema); exporting it unchanged. "
+          "Re-run load_rules.py to migrate it to cents.")
+
 # -------------------------
 # CALENDAR / DATE DIM (single source of truth)
 # -------------------------
@@ -779,7 +898,7 @@ safe_copy("transactions_with_category", "transactions_with_category.parquet")
 safe_copy("monthly_cashflow", "monthly_cashflow.parquet")
 safe_copy("monthly_actuals_by_category", "monthly_actuals_by_category.parquet")
 safe_copy("monthly_actuals_by_category_enriched", "monthly_actuals_by_category_enriched.parquet")
-safe_copy("budget_monthly", "budget_monthly.parquet")
+safe_copy("budget_monthly_report", "budget_monthly.parquet")
 safe_copy("category_dim", "category_dim.parquet")
 safe_copy("security_dim", "security_dim.parquet")
 safe_copy("month_dim", "month_dim.parquet")
@@ -1,42 +1,62 @@
 """
 Create (or open) finance.duckdb and ensure base tables exist.
 
+This is the one definition of the transactions schema; loaders call
+ensure_schema() rather than carrying their own CREATE TABLE.
+
 Tables created:
 - transactions: raw transaction feed (one row per transaction)
 
 Env:
-- DATA_DIR: folder where finance.duckdb lives (set in .env)
+- DATA_DIR / DUCKDB_PATH: where finance.duckdb lives (set in .env; see _db.py)
 
 Run:
     python src/etl/init_db.py
 """
 
-import os
-from pathlib import Path
 import duckdb
-from dotenv import load_dotenv
-
-load_dotenv()  # reads DATA_DIR from .env
-DATA_DIR = Path(os.getenv("DATA_DIR", r"C:\Users\jo136\OneDrive\FinanceData"))
-DB = DATA_DIR / "finance.duckdb"
-DB.parent.mkdir(parents=True, exist_ok=True)
-
-con = duckdb.connect(str(DB))
-con.execute("""
-CREATE TABLE IF NOT EXISTS transactions (
-    txn_id TEXT PRIMARY KEY,
-    date DATE,
-    account_id TEXT,
-    amount_cents BIGINT,
-    amount DOUBLE,
-    description TEXT,
-    merchant_norm TEXT,
-    category TEXT,
-    subcategory TEXT,
-    memo TEXT,
-    tags TEXT,
-    is_transfer BOOLEAN DEFAULT FALSE
-)
-""")
-con.close()
-print(f"DB ready at {DB}")
+
+from _db import DB_PATH, get_con
+
+# Column order of `transactions`; loaders emit frames in exactly this order
+TRANSACTIONS_COLUMNS = ["txn_id", "date", "account_id", "amount_cents", "amount",
+                        "description", "merchant_norm", "category", "memo", "tags", "is_transfer"]
+
+def ensure_schema(con: duckdb.DuckDBPyConnection) -> None:
+    con.execute("""
+    CREATE TABLE IF NOT EXISTS transactions (
+        txn_id TEXT PRIMARY KEY,
+        date DATE,
+        account_id TEXT,
+        amount_cents BIGINT,
+        amount DOUBLE,
+        description TEXT,
+        merchant_norm TEXT,
+        category TEXT,
+        memo TEXT,
+        tags TEXT,
+        is_transfer BOOLEAN DEFAULT FALSE
+    )
+    """)
+
+def ensure_txn_id_unique(con: duckdb.DuckDBPyConnection) -> None:
+    """Make txn_id unique (needed by ON CONFLICT / MERGE) unless a key or index already does.
+
+    Tables created by ensure_schema() have it as PRIMARY KEY; only older tables need the index.
+    Checking the catalog first avoids the scan a redundant CREATE INDEX would do.
+    """
+    covered = con.execute("""
+        SELECT 1 FROM duckdb_constraints()
+        WHERE table_name = 'transactions' AND constraint_type IN ('PRIMARY KEY', 'UNIQUE')
+          AND constraint_column_names = ['txn_id']
+        UNION ALL
+        SELECT 1 FROM duckdb_indexes()
+        WHERE table_name = 'transactions' AND index_name = 'ux_transactions_txn_id'
+        LIMIT 1
+    """).fetchone()
+    if covered is None:
+        con.execute("CREATE UNIQUE INDEX ux_transactions_txn_id ON transactions(txn_id)")
+
+if __name__ == "__main__":
+    ensure_schema(get_con())
+    print(f"DB ready at {DB_PATH}")
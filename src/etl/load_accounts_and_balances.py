@@ -1,29 +1,59 @@
 # src/etl/load_accounts_and_balances.py
 from __future__ import annotations
-import os, re, glob
+import re, glob
 from pathlib import Path
-import duckdb
-import pandas as pd
-from dotenv import load_dotenv
+import pyarrow as pa
+from pyarrow import csv as pacsv
 
-load_dotenv()
+from _db import DATA_DIR, get_con
 
-DATA_DIR = Path(os.getenv("DATA_DIR", r"C:\Users\jo136\OneDrive\FinanceData"))
-DB_PATH  = Path(os.getenv("DUCKDB_PATH", DATA_DIR / "finance.duckdb"))
 BAL_DIR  = DATA_DIR / "balances"
 BAL_DIR.mkdir(parents=True, exist_ok=True)
 
-con = duckdb.connect(str(DB_PATH))
+# Empty cells -> null (same as pandas NaN), not ""
+CSV_OPTS = pacsv.ConvertOptions(strings_can_be_null=True)
 
-# Ensure tables exist
-con.execute("""
-CREATE TABLE IF NOT EXISTS balance_snapshot (
+con = get_con()
+
+# Ensure tables exist (money stored as integer cents)
+BALANCE_SNAPSHOT_DDL = """
+CREATE TABLE {name} (
   as_of_date DATE,
   account_id TEXT,
-  balance DOUBLE,
+  balance_cents BIGINT,
   PRIMARY KEY(as_of_date, account_id)
 )
-""")
+"""
+
+def _migrate_balance_to_cents():
+    """One-time rewrite of a legacy `balance DOUBLE` table into `balance_cents BIGINT`."""
+    cols = {r[0] for r in con.execute(
+        "SELECT column_name FROM information_schema.columns WHERE table_name = 'balance_snapshot'"
+    ).fetchall()}
+    if "balance" not in cols or "balance_cents" in cols:
+        return
+    con.execute(BALANCE_SNAPSHOT_DDL.format(name="balance_snapshot__new"))
+    con.execute("""
+        INSERT INTO balance_snapshot__new
+        SELECT as_of_date, account_id, CAST(ROUND(balance * 100) AS BIGINT)
+        FROM balance_snapshot
+    """)
+    con.execute("DROP TABLE balance_snapshot")
+    con.execute("ALTER TABLE balance_snapshot__new RENAME TO balance_snapshot")
+    print("Migrated balance_snapshot.balance -> balance_cents")
+
+_migrate_balance_to_cents()
+con.execute(BALANCE_SNAPSHOT_DDL.format(name="IF NOT EXISTS balance_snapshot"))
+
+# as_of_date text -> DATE, accepting what pd.to_datetime used to: ISO dates, ISO timestamps
+# ("2024-02-29 00:00:00"), US "02/29/2024" / "2/9/24", "Feb 29, 2024". Unparseable -> NULL.
+DATE_FORMATS = ["%m/%d/%y", "%m/%d/%Y", "%Y/%m/%d", "%b %d, %Y", "%B %d, %Y"]
+
+def _date_sql(col: str) -> str:
+    v = f'CAST("{col}" AS VARCHAR)'
+    fmts = ", ".join(f"'{f}'" for f in DATE_FORMATS)
+    return (f"COALESCE(TRY_CAST({v} AS DATE), CAST(TRY_CAST({v} AS TIMESTAMP) AS DATE), "
+            f"CAST(try_strptime({v}, [{fmts}]) AS DATE))")
 
 def infer_date_from_filename(p: Path):
     # looks for YYYY-MM-DD in file name
@@ -36,12 +66,14 @@ if not csvs:
     raise SystemExit(0)
 
 total_rows = 0
-for f in csvs:
+staged = []   # one normalized Arrow table per file; concatenated (zero-copy) for a single upsert
+for seq, f in enumerate(csvs):
     print("Loading", f)
-    df = pd.read_csv(f)
+    # PyArrow's multi-threaded parser; the Arrow table is scanned by DuckDB without a pandas hop
+    tbl = pacsv.read_csv(f, convert_options=CSV_OPTS)
 
     # Normalize headers
-    cols = {c.lower(): c for c in df.columns}
+    cols = {c.lower(): c for c in tbl.column_names}
     # preferred names
     date_col = cols.get("as_of_date")
     acct_col = cols.get("account_id") or cols.get("account")
@@ -50,36 +82,59 @@ for f in csvs:
     if acct_col is None or bal_col is None:
         raise ValueError(f"{f} missing required columns (need account_id/account and balance/amount)")
 
-    df = df.rename(columns={
-        acct_col: "account_id",
-        bal_col:  "balance"
-    })
-
     # Determine as_of_date
     if date_col:
-        df["as_of_date"] = pd.to_datetime(df[date_col], errors="coerce").dt.date
+        date_expr = _date_sql(date_col)
     else:
         inferred = infer_date_from_filename(Path(f))
         if not inferred:
             raise ValueError(f"Could not infer date from filename: {f} (expected YYYY-MM-DD in name)")
-        df["as_of_date"] = pd.to_datetime(inferred).date()
+        date_expr = f"DATE '{inferred}'"
 
-    # Coerce numeric balance
-    df["balance"] = pd.to_numeric(df["balance"], errors="coerce").fillna(0.0)
+    total_rows += tbl.num_rows
 
-    # Keep final columns only
-    df = df[["as_of_date", "account_id", "balance"]]
-    total_rows += len(df)
+    # Project to the common shape; balance coerced to numeric (bad values -> 0) and stored as cents
+    con.register("raw_bal", tbl)
+    part = con.execute(f"""
+        SELECT
+          {date_expr}                                        AS as_of_date,
+          CAST("{acct_col}" AS VARCHAR)                      AS account_id,
+          CAST(ROUND(COALESCE(TRY_CAST(CAST("{bal_col}" AS VARCHAR) AS DOUBLE), 0) * 100) AS BIGINT) AS balance_cents,
+          {seq}                                              AS file_seq
+        FROM raw_bal
+    """).to_arrow_table()
+    con.unregister("raw_bal")
 
-    # Upsert into DuckDB (requires PRIMARY KEY on (as_of_date, account_id))
-    con.register("staging_bal", df)
-    con.execute("""
-        INSERT INTO balance_snapshot AS t
-        SELECT as_of_date, account_id, balance
-        FROM staging_bal
-        ON CONFLICT (as_of_date, account_id) DO UPDATE SET
-            balance = excluded.balance
-    """)
+    # as_of_date is part of the primary key: report and drop rows whose date didn't parse
+    bad = part["as_of_date"].null_count
+    if bad:
+        print(f"[WARN] {f}: dropped {bad} row(s) with an unparseable as_of_date")
+        part = part.filter(part["as_of_date"].is_valid())
+
+    # Same key twice within one file is ambiguous (which balance is right?) -> fail, as the per-file upsert did
+    con.register("part_bal", part)
+    dupes = con.execute("""
+        SELECT as_of_date, account_id, COUNT(*) AS n FROM part_bal
+        GROUP BY ALL HAVING COUNT(*) > 1 ORDER BY ALL LIMIT 5
+    """).fetchall()
+    con.unregister("part_bal")
+    if dupes:
+        raise ValueError(f"{f} has duplicate (as_of_date, account_id) rows, e.g. {dupes}")
+    staged.append(part)
+
+# Upsert into DuckDB (requires PRIMARY KEY on (as_of_date, account_id)).
+# Keys are unique within a file (checked above), so ROW_NUMBER only breaks ties across files:
+# later files win, as they did when each file was upserted in turn.
+con.register("staging_bal", pa.concat_tables(staged))
+con.execute("""
+    INSERT INTO balance_snapshot AS t
+    SELECT as_of_date, account_id, balance_cents
+    FROM staging_bal
+    QUALIFY ROW_NUMBER() OVER (PARTITION BY as_of_date, account_id ORDER BY file_seq DESC) = 1
+    ON CONFLICT (as_of_date, account_id) DO UPDATE SET
+        balance_cents = excluded.balance_cents
+""")
+con.unregister("staging_bal")
 
 cnt = con.execute("SELECT COUNT(*) FROM balance_snapshot").fetchone()[0]
 print(f"Balances upsert complete. balance_snapshot rows: {cnt} (processed {total_rows} staged rows across {len(csvs)} files)")
@@ -7,16 +7,15 @@ Inputs (CSV in repo/rules/):
 
 Creates/updates DuckDB tables:
 - category_dim(category TEXT PRIMARY KEY, parent_category TEXT, top_bucket TEXT)
-- budget_monthly(month DATE, category TEXT, amount DECIMAL(18,2))
+- budget_monthly(month DATE, category TEXT, amount_cents BIGINT)
 
 Run:
     python src/etl/load_categories_and_budget.py
 """
-import os
 from pathlib import Path
-import duckdb
 import pandas as pd
-from dotenv import load_dotenv
+
+from _db import DB_PATH, get_con
 
 # Repo paths
 HERE = Path(__file__).resolve()
@@ -25,11 +24,6 @@ RULES = REPO / "rules"
 CAT_CSV = RULES / "category_dim.csv"
 BUD_CSV = RULES / "budget_monthly.csv"
 
-# Data/DB path
-load_dotenv()
-DATA_DIR = Path(os.getenv("DATA_DIR", r"C:\Users\jo136\OneDrive\FinanceData"))
-DB = DATA_DIR / "finance.duckdb"
-
 def main():
     if not CAT_CSV.exists():
         raise SystemExit(f"Missing {CAT_CSV}")
@@ -46,38 +40,37 @@ def main():
     bud = pd.read_csv(BUD_CSV)
     bud["month"] = pd.to_datetime(bud["month"], errors="coerce").dt.date
     bud["category"] = bud["category"].astype(str).str.strip()
-    bud["amount"] = pd.to_numeric(bud["amount"], errors="coerce").fillna(0.0).round(2)
+    bud["amount_cents"] = (pd.to_numeric(bud["amount"], errors="coerce").fillna(0.0) * 100).round().astype("int64")
+    bud = bud[["month", "category", "amount_cents"]]
 
-    with duckdb.connect(str(DB)) as con:
-        # Ensure tables
-        con.execute("""
-            CREATE TABLE IF NOT EXISTS category_dim (
-                category TEXT PRIMARY KEY,
-                parent_category TEXT,
-                top_bucket TEXT
-            );
-        """)
-        con.execute("""
-            CREATE TABLE IF NOT EXISTS budget_monthly (
-                month DATE,
-                category TEXT,
-                amount DECIMAL(18,2)
-            );
-        """)
-        # Replace contents (simple & explicit)
-        con.execute("DELETE FROM category_dim;")
-        con.execute("DELETE FROM budget_monthly;")
+    con = get_con()
+    # Ensure tables
+    con.execute("""
+        CREATE TABLE IF NOT EXISTS category_dim (
+            category TEXT PRIMARY KEY,
+            parent_category TEXT,
+            top_bucket TEXT
+        );
+    """)
+    # budget_monthly is fully replaced each run, so recreate it (also upgrades old DECIMAL schemas)
+    con.execute("""
+        CREATE OR REPLACE TABLE budget_monthly (
+            month DATE,
+            category TEXT,
+            amount_cents BIGINT
+        );
+    """)
+    # Replace contents (simple & explicit)
+    con.execute("DELETE FROM category_dim;")
 
-        # Load
-        con.register("cat_df", cat)
-        con.register("bud_df", bud)
-        con.execute("INSERT INTO category_dim SELECT * FROM cat_df;")
-        con.execute("INSERT INTO budget_monthly SELECT * FROM bud_df;")
+    # Load via the Appender (no SQL parse/plan; dims are a few hundred rows at most)
+    con.append("category_dim", cat)
+    con.append("budget_monthly", bud)
 
-        # Helpful index for budget lookups
-        con.execute("CREATE UNIQUE INDEX IF NOT EXISTS ux_budget ON budget_monthly(month, category);")
+    # Helpful index for budget lookups
+    con.execute("CREATE UNIQUE INDEX IF NOT EXISTS ux_budget ON budget_monthly(month, category);")
 
-    print(f"Loaded {len(cat)} categories and {len(bud)} budget rows into {DB}")
+    print(f"Loaded {len(cat)} categories and {len(bud)} budget rows into {DB_PATH}")
 
 if __name__ == "__main__":
     main()
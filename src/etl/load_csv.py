@@ -3,8 +3,10 @@ Load a CSV of transactions into DuckDB (idempotent).
 
 What it does:
 - Reads CSV at DATA_DIR/sample_transactions.csv
-- Normalizes headers and types
+- Normalizes headers and types into the init_db.py transactions column order
 - Builds a stable txn_id from (date, account_id, merchant_norm, amount_cents, dup_seq)
+  (BLAKE2b, 20-byte digest; rows keyed with the old SHA-1 ids are re-keyed by
+  migrate_002_blake2b_txn_id.py)
 - INSERT ... ON CONFLICT (txn_id) DO NOTHING
 
 Requires:
@@ -20,17 +22,46 @@ Run:
     python src/etl/load_csv.py
 """
 
-import os, hashlib
-from pathlib import Path
-import duckdb, pandas as pd
-from dotenv import load_dotenv
+import hashlib
+import numpy as np
+import pandas as pd
+from pyarrow import csv as pacsv
 
-load_dotenv()
-DATA_DIR = Path(os.getenv("DATA_DIR", r"C:\Users\jo136\OneDrive\FinanceData"))
-DB = DATA_DIR / "finance.duckdb"
-CSV = DATA_DIR / "sample_transactions.csv"
+from _db import DATA_DIR, get_con
+from init_db import TRANSACTIONS_COLUMNS, ensure_schema, ensure_txn_id_unique
 
-def normalize(df: pd.DataFrame) -> pd.DataFrame:
+CSV = DATA_DIR / "sample_transactions.csv"
+CSV_OPTS = pacsv.ConvertOptions(strings_can_be_null=True)  # empty cells -> null, like pandas NaN
+
+def make_txn_id(raw: str) -> str:
+    # BLAKE2b-160: same 40-hex width as the old SHA-1 ids, cheaper per row
+    return hashlib.blake2b(raw.encode("utf-8"), digest_size=20).hexdigest()
+
+def legacy_sha1_txn_id(raw: str) -> str:
+    # Pre-BLAKE2b ids; only used by migrate_002 to re-key existing rows
+    return hashlib.sha1(raw.encode("utf-8")).hexdigest()
+
+def _dup_seq(df: pd.DataFrame, keys: list[str]) -> pd.Series:
+    """groupby(keys).cumcount() via one stable sort + run starts (no GroupBy objects).
+    Like cumcount, rows with a missing key get NaN (and the column turns float)."""
+    n = len(df)
+    codes = np.zeros(n, dtype=np.int64)
+    has_na = np.zeros(n, dtype=bool)
+    for k in keys:
+        c, uniq = pd.factorize(df[k])
+        has_na |= c < 0
+        codes = pd.factorize(codes * (len(uniq) + 1) + c)[0]  # re-densify so the combined code never overflows
+    order = np.argsort(codes, kind="stable")
+    sorted_codes = codes[order]
+    pos = np.arange(n)
+    starts = np.r_[True, sorted_codes[1:] != sorted_codes[:-1]] if n else np.zeros(0, dtype=bool)
+    seq = np.empty(n, dtype=np.int64)
+    seq[order] = pos - np.maximum.accumulate(np.where(starts, pos, 0))
+    if has_na.any():
+        return pd.Series(np.where(has_na, np.nan, seq), index=df.index)
+    return pd.Series(seq, index=df.index)
+
+def normalize(df: pd.DataFrame, hasher=make_txn_id) -> pd.DataFrame:
     # Map common column names → our standard
     cols = {c.lower().strip(): c for c in df.columns}
     date_col = next(k for k in cols if k in ("date", "posted date", "transaction date"))
@@ -38,23 +69,21 @@ def normalize(df: pd.DataFrame) -> pd.DataFrame:
     amt_col  = next(k for k in cols if k in ("amount", "amt", "transaction amount"))
     acct_col = next((k for k in cols if k in ("account", "account name", "account id")), None)
     cat_col  = next((k for k in cols if k in ("category", "cat")), None)
-    sub_col  = next((k for k in cols if k in ("subcategory", "sub-cat", "sub category")), None)
     memo_col = next((k for k in cols if k in ("memo", "notes", "note")), None)
 
     out = pd.DataFrame({
         "date": pd.to_datetime(df[cols[date_col]], errors="coerce").dt.date,
-        "merchant": df[cols[desc_col]].astype(str).str.strip(),
+        "description": df[cols[desc_col]].astype(str).str.strip(),
         "amount": pd.to_numeric(df[cols[amt_col]], errors="coerce").fillna(0.0).round(2),
         "account_id": (df[cols[acct_col]].astype(str).str.strip() if acct_col else "unknown"),
         "category": (df[cols[cat_col]].astype(str).str.strip() if cat_col else None),
-        "subcategory": (df[cols[sub_col]].astype(str).str.strip() if sub_col else None),
         "memo": (df[cols[memo_col]].astype(str).str.strip() if memo_col else None),
     })
 
     # ---- Build a stable identity (NO memo). ----
     # 1) Normalize merchant to reduce noise
     out["merchant_norm"] = (
-        out["merchant"]
+        out["description"]
         .str.lower()
         .str.replace(r"[^a-z0-9 ]+", "", regex=True)  # drop punctuation
         .str.replace(r"\s+", " ", regex=True)         # collapse whitespace
@@ -62,44 +91,42 @@ def normalize(df: pd.DataFrame) -> pd.DataFrame:
     )
 
     # 2) Amount in cents (int) to avoid float noise
-    out["amount_cents"] = (out["amount"] * 100).round().astype("Int64")
+    out["amount_cents"] = (out["amount"] * 100).round().astype("int64")
 
     # 3) Tie-breaker for truly identical charges same day
-    out["dup_seq"] = out.groupby(
-        ["date", "account_id", "merchant_norm", "amount_cents"]
-    ).cumcount()
+    out["dup_seq"] = _dup_seq(out, ["date", "account_id", "merchant_norm", "amount_cents"])
 
     # 4) Deterministic txn_id from STABLE fields
-    def _id(row):
-        raw = f"{row.date}|{row.account_id}|{row.merchant_norm}|{row.amount_cents}|{row.dup_seq}"
-        return hashlib.sha1(raw.encode("utf-8")).hexdigest()
-
-    out["txn_id"] = out.apply(_id, axis=1)
+    #    (tight loop over the column arrays: no per-row Series like apply(axis=1))
+    cols = [out[c].to_numpy() for c in ("date", "account_id", "merchant_norm", "amount_cents", "dup_seq")]
+    out["txn_id"] = [hasher(f"{d}|{a}|{m}|{c}|{s}") for d, a, m, c, s in zip(*cols)]
 
-    # Final columns for the table (extra helper cols are not inserted)
+    # Final columns in table order so INSERT ... SELECT * is a straight copy
     out["tags"] = None
-    return out[["txn_id", "date", "account_id", "merchant", "memo",
-                "amount", "category", "subcategory", "tags"]]
+    out["is_transfer"] = False
+    return out[TRANSACTIONS_COLUMNS]
 
 def main():
     if not CSV.exists():
         raise SystemExit(f"Missing CSV: {CSV}")
 
-    df = pd.read_csv(CSV)
+    # Multithreaded Arrow parse; normalize() still works on the pandas view of it
+    df = pacsv.read_csv(CSV, convert_options=CSV_OPTS).to_pandas()
     df = normalize(df)
 
-    with duckdb.connect(str(DB)) as con:
-        # Ensure the unique index exists so ON CONFLICT works (safe to run every time)
-        con.execute("CREATE UNIQUE INDEX IF NOT EXISTS ux_transactions_txn_id ON transactions(txn_id);")
+    con = get_con()
+    ensure_schema(con)
+    # ON CONFLICT needs a unique txn_id (primary key, or the migrate_001 index on older tables)
+    ensure_txn_id_unique(con)
 
-        con.execute("CREATE TEMP TABLE t AS SELECT * FROM df")
+    con.execute("CREATE TEMP TABLE t AS SELECT * FROM df")
 
-        # Insert new rows only
-        con.execute("""
-            INSERT INTO transactions
-            SELECT * FROM t
-            ON CONFLICT (txn_id) DO NOTHING
-        """)
+    # Insert new rows only
+    con.execute("""
+        INSERT INTO transactions
+        SELECT * FROM t
+        ON CONFLICT (txn_id) DO NOTHING
+    """)
 
     print(f"Loaded {len(df)} rows from {CSV.name}")
 
@@ -3,27 +3,23 @@ r"""
 Load normalized positions into DuckDB with snapshot-replace semantics per (as_of_date, account_id).
 
 Strategy:
-1) Read normalized CSVs recursively under .../positions/normalized/<vendor>/<route>/positions_YYYY-MM-DD.csv
-2) Normalize keys: account_id = UPPER(TRIM(account_id)), symbol = TRIM(symbol)
-3) Keep only the NEWEST row per (as_of_date, account_id, symbol) using file mtime
-4) MERGE (UPSERT) rows -> updates existing & inserts new without constraint errors
-5) Anti-delete: remove any positions in those snapshots that are NOT in staging (handles sells)
+1) Read normalized CSVs recursively (single os.scandir walk; stat cached per entry) under .../positions/normalized/<vendor>/<route>/positions_YYYY-MM-DD.csv
+2) Normalize keys: account_id = UPPER(TRIM(account_id)), symbol = TRIM(symbol);
+   market_value = CSV market_value (shares * price only when the CSV value is missing)
+3) Keep only the NEWEST row per (as_of_date, account_id, symbol) using file mtime (DuckDB window, QUALIFY)
+4) DELETE the (as_of_date, account_id) snapshots being refreshed (handles sells)
+5) INSERT the staged rows in one statement
 """
 
-import os, glob
-from pathlib import Path
-import pandas as pd
-import duckdb
-from dotenv import load_dotenv
+import os
+
+from _db import DATA_DIR, get_con
 
-load_dotenv()
-DATA_DIR  = Path(os.getenv("DATA_DIR", r"C:\Users\jo136\OneDrive\FinanceData"))
-DB_PATH   = Path(os.getenv("DUCKDB_PATH", DATA_DIR / "finance.duckdb"))
 NORM_ROOT = DATA_DIR / "positions" / "normalized"
 
-con = duckdb.connect(str(DB_PATH))
+con = get_con()
 
-# Table + unique index (idempotent)
+# Table (idempotent)
 con.execute("""
 CREATE TABLE IF NOT EXISTS positions(
   as_of_date DATE,
@@ -34,96 +30,123 @@ CREATE TABLE IF NOT EXISTS positions(
   market_value DOUBLE
 );
 """)
-con.execute("""CREATE UNIQUE INDEX IF NOT EXISTS ux_positions
-               ON positions(as_of_date, account_id, symbol);""")
-
-def _load_normalized_files() -> pd.DataFrame:
-    files = glob.glob(str(NORM_ROOT / "**" / "positions_*.csv"), recursive=True)
-    # Ignore any legacy flat files that might sit directly under .../normalized/
-    files = [f for f in files if Path(f).parent != NORM_ROOT]
+# No unique index: a persisted ART index rejects DELETE + re-INSERT of the same key inside
+# one transaction. Uniqueness comes from the newest-wins staging + per-snapshot DELETE below.
+con.execute("DROP INDEX IF EXISTS ux_positions")
+
+def _scan_normalized_files() -> list[tuple[str, float]]:
+    """(path, mtime) for every positions_*.csv below a vendor/route folder; one scandir pass."""
+    found = []
+    stack = [NORM_ROOT]
+    while stack:
+        d = stack.pop()
+        try:
+            it = os.scandir(d)
+        except FileNotFoundError:
+            continue
+        with it:
+            for entry in it:
+                if entry.is_dir(follow_symlinks=False):
+                    stack.append(entry.path)
+                # Ignore any legacy flat files that might sit directly under .../normalized/
+                elif (d != NORM_ROOT and entry.name.startswith("positions_")
+                      and entry.name.endswith(".csv")):
+                    found.append((entry.path, entry.stat(follow_symlinks=False).st_mtime))
+    return found
+
+NEED_COLS = ["as_of_date","account_id","symbol","shares","price","market_value"]
+
+def _stage_normalized_files() -> int:
+    """
+    Build TEMP TABLE staging_all (newest file wins per date/account/symbol) in one
+    DuckDB read over every normalized CSV. Returns the number of files staged.
+    """
+    files = _scan_normalized_files()
 
     if not files:
         print(f"[load_positions] No normalized files found under: {NORM_ROOT}")
-        return pd.DataFrame(columns=[
-            "as_of_date","account_id","symbol","shares","price","market_value","__mtime","__path"
-        ])
-
-    frames = []
-    for f in files:
-        p = Path(f)
-        df = pd.read_csv(p)
-        need = {"as_of_date","account_id","symbol","shares","price","market_value"}
-        miss = need - set(df.columns)
-        if miss:
-            raise ValueError(f"{p} missing columns: {miss}")
+        return 0
 
-        df["as_of_date"]  = pd.to_datetime(df["as_of_date"]).dt.date
-        df["account_id"]  = df["account_id"].astype(str).str.strip().str.upper()
-        df["symbol"]      = df["symbol"].astype(str).str.strip()
-        df["shares"]      = pd.to_numeric(df["shares"], errors="coerce")
-        df["price"]       = pd.to_numeric(df["price"], errors="coerce")
-        df["market_value"]= pd.to_numeric(df["market_value"], errors="coerce")
-        df["__mtime"]     = p.stat().st_mtime
-        df["__path"]      = str(p)
-        frames.append(df)
+    # Header check up front; union_by_name would otherwise silently NULL-fill a missing column
+    for path, _ in files:
+        with open(path, encoding="utf-8-sig") as fh:
+            header = {h.strip() for h in fh.readline().rstrip("\r\n").split(",")}
+        miss = set(NEED_COLS) - header
+        if miss:
+            raise ValueError(f"{path} missing columns: {miss}")
 
-    staging = pd.concat(frames, ignore_index=True)
+    con.execute("CREATE OR REPLACE TEMP TABLE mtimes(path TEXT PRIMARY KEY, mt DOUBLE)")
+    con.executemany("INSERT INTO mtimes VALUES (?, ?)", files)
 
     # Keep only newest file per (date, account, symbol)
-    staging = (
-        staging.sort_values("__mtime", ascending=False)
-               .drop_duplicates(subset=["as_of_date","account_id","symbol"], keep="first")
-    )
-    return staging
+    con.execute("""
+        CREATE OR REPLACE TEMP TABLE staging_all AS
+        SELECT as_of_date, account_id, symbol, shares, price, market_value, path
+        FROM (
+            SELECT
+              CAST(t.as_of_date AS DATE)             AS as_of_date,
+              UPPER(TRIM(t.account_id))              AS account_id,
+              TRIM(t.symbol)                         AS symbol,
+              TRY_CAST(t.shares AS DOUBLE)           AS shares,
+              TRY_CAST(t.price AS DOUBLE)            AS price,
+              -- Broker-reported value wins; shares * price only fills a missing one
+              COALESCE(TRY_CAST(t.market_value AS DOUBLE),
+                       TRY_CAST(t.shares AS DOUBLE) * TRY_CAST(t.price AS DOUBLE)) AS market_value,
+              m.path,
+              m.mt
+            FROM read_csv_auto(?, union_by_name=true, filename=true, all_varchar=true, header=true) t
+            JOIN mtimes m ON m.path = t.filename
+        )
+        QUALIFY ROW_NUMBER() OVER (
+            PARTITION BY as_of_date, account_id, symbol ORDER BY mt DESC, path DESC
+        ) = 1
+    """, [[p for p, _ in files]])
+    return len(files)
 
 def load_all():
-    staging = _load_normalized_files()
-    if staging.empty:
+    n_files = _stage_normalized_files()
+    if n_files == 0:
         return
 
     # Snapshots (date+account) we are refreshing atomically
-    keys = staging[["as_of_date","account_id"]].drop_duplicates()
-
-    # Register for SQL
-    con.register("staging_all",
-        staging[["as_of_date","account_id","symbol","shares","price","market_value"]])
-    con.register("keys", keys)
-
-    print(f"[load_positions] Files staged: {staging['__path'].nunique()} | "
-          f"Rows staged (deduped): {len(staging)} | "
-          f"Snapshots: {len(keys)}")
-
-    con.execute("BEGIN")
-
-    # 1) UPSERT (update existing rows, insert new) to avoid unique key errors
-    con.execute("""
-        MERGE INTO positions p
-        USING staging_all s
-        ON  p.as_of_date = s.as_of_date
-        AND p.account_id = s.account_id
-        AND p.symbol     = s.symbol
-        WHEN MATCHED THEN UPDATE SET
-            shares = s.shares,
-            price  = s.price,
-            market_value = s.market_value
-        WHEN NOT MATCHED THEN INSERT (as_of_date, account_id, symbol, shares, price, market_value)
-        VALUES (s.as_of_date, s.account_id, s.symbol, s.shares, s.price, s.market_value);
-    """)
-
-    # 2) Anti-delete: remove any positions for those (date, account) that are NOT in staging
-    #    (handles sells and guarantees exact snapshot for each date+account)
-    con.execute("""
-        DELETE FROM positions p
-        WHERE (p.as_of_date, p.account_id) IN (SELECT as_of_date, account_id FROM keys)
-          AND NOT EXISTS (
-            SELECT 1 FROM staging_all s
-            WHERE s.as_of_date = p.as_of_date
-              AND s.account_id = p.account_id
-              AND s.symbol     = p.symbol
-          );
-    """)
-
-    con.execute("COMMIT")
+    con.execute("CREATE OR REPLACE TEMP TABLE keys AS SELECT DISTINCT as_of_date, account_id FROM staging_all")
+    n_rows = con.execute("SELECT COUNT(*) FROM staging_all").fetchone()[0]
+    n_keys = con.execute("SELECT COUNT(*) FROM keys").fetchone()[0]
+
+    print(f"[load_positions] Files staged: {n_files} | "
+          f"Rows staged (deduped): {n_rows} | "
+          f"Snapshots: {n_keys}")
+
+    # Cold load (empty table, or POSITIONS_FULL_RELOAD=1): every snapshot comes from disk,
+    # so write the table in one CREATE OR REPLACE ... AS SELECT instead of DELETE + INSERT.
+    full_reload = os.getenv("POSITIONS_FULL_RELOAD", "").strip().lower() in ("1", "true", "yes")
+    if full_reload or con.execute("SELECT COUNT(*) FROM positions").fetchone()[0] == 0:
+        con.execute("""
+            CREATE OR REPLACE TABLE positions AS
+            SELECT as_of_date, account_id, symbol, shares, price, market_value
+            FROM staging_all
+            WHERE symbol IS NOT NULL
+            ORDER BY as_of_date, account_id, symbol;
+        """)
+        print("[load_positions] Cold load: rebuilt positions from staging")
+    else:
+        con.execute("BEGIN")
+
+        # Snapshot replaces snapshot: clear every (date, account) being refreshed, then insert
+        # the deduped staging rows (newest-wins already applied, so keys stay unique).
+        # Dropping symbols that vanished from a snapshot (sells) falls out of the DELETE.
+        con.execute("""
+            DELETE FROM positions
+            WHERE (as_of_date, account_id) IN (SELECT as_of_date, account_id FROM keys);
+        """)
+        con.execute("""
+            INSERT INTO positions (as_of_date, account_id, symbol, shares, price, market_value)
+            SELECT as_of_date, account_id, symbol, shares, price, market_value
+            FROM staging_all
+            WHERE symbol IS NOT NULL;
+        """)
+
+        con.execute("COMMIT")
 
     total = con.execute("SELECT COUNT(*) FROM positions").fetchone()[0]
     print(f"[load_positions] Done. positions row count: {total}")
@@ -1,40 +1,29 @@
 
 import pandas as pd
 import numpy as np
-import os
-from pathlib import Path
+import pyarrow as pa
 import duckdb
-from typing import Tuple, Dict, Any
+import hashlib
 from datetime import date
+from pathlib import Path
 
-# Create connections
-
-DATA_DIR = Path(os.getenv("DATA_DIR", r"C:\Users\jo136\OneDrive\FinanceData"))
-DB_PATH  = Path(os.getenv("DUCKDB_PATH", DATA_DIR / "finance.duckdb"))
+from _db import get_con
+from _kernels import expand_timed_rows, inflation_curve, rollforward
 
-con = duckdb.connect(str(DB_PATH))
+# No connection or query at import time: callers that only need the CSV parsing
+# (load_retirement_assumptions, looks_like_rate) never touch DuckDB.
 
 sql_balances = """
-WITH ranked AS (
-  SELECT
-    p.*,
-    ROW_NUMBER() OVER (
-      PARTITION BY p.account_id, p.symbol
-      ORDER BY p.as_of_date DESC
-    ) AS rn
-  FROM positions_enriched p
-)
 SELECT
   p.account_id,
   COALESCE(a.account_name, p.account_id) AS account_name,
   COALESCE(a.Tax_Bucket, 'Unknown')      AS tax_bucket_final,
   COALESCE(a.owner, '')                  AS owner,
   SUM(p.value)                           AS balance_today
-FROM ranked p
+FROM latest_positions p
 LEFT JOIN account_dim a
   ON a.account_id = p.account_id
-WHERE p.rn = 1
-  AND COALESCE(a.include_networth, TRUE)
+WHERE COALESCE(a.include_networth, TRUE)
 GROUP BY
   p.account_id,
   account_name,
@@ -43,9 +32,25 @@ GROUP BY
 ORDER BY p.account_id;
 """
 
-starting_balances_df = con.execute(sql_balances).df()
-# optional: write for debugging / PBI import
-# starting_balances_df.to_csv(<outdir>/ret_starting_balances.csv, index=False)
+def ensure_latest_positions(con: duckdb.DuckDBPyConnection) -> None:
+    """
+    TEMP TABLE latest_positions: newest row per (account_id, symbol) from positions_enriched.
+    Shared by sql_balances and both dividend views so the window runs once per session.
+    """
+    con.execute("""
+    CREATE OR REPLACE TEMP TABLE latest_positions AS
+    -- only the columns read downstream; keeps the window sort narrow
+    SELECT p.account_id, p.symbol, p.as_of_date, p.value
+    FROM positions_enriched p
+    QUALIFY ROW_NUMBER() OVER (
+      PARTITION BY p.account_id, p.symbol
+      ORDER BY p.as_of_date DESC
+    ) = 1
+    """)
+
+def get_starting_balances(con: duckdb.DuckDBPyConnection) -> pd.DataFrame:
+    """Latest balance per account (from latest_positions), for ret_starting_balances.csv."""
+    return con.execute(sql_balances).df()
 
 RATE_VAR_HINTS = {
     "inflation_rate",
@@ -57,25 +62,35 @@ RATE_VAR_HINTS = {
     "tax_rate_retirement"
 }
 
+def create_view_if_changed(con: duckdb.DuckDBPyConnection, name: str, body_sql: str) -> None:
+    """
+    CREATE OR REPLACE VIEW {name} AS {body_sql}, skipped when the stored signature in
+    etl_state matches and the view still exists (saves the parse/bind on every run).
+    """
+    sig = hashlib.sha1(body_sql.encode("utf-8")).hexdigest()
+    con.execute("CREATE TABLE IF NOT EXISTS etl_state (key TEXT PRIMARY KEY, value TEXT)")
+    row = con.execute("SELECT value FROM etl_state WHERE key = ?", [f"view:{name}"]).fetchone()
+    exists = con.execute(
+        "SELECT 1 FROM information_schema.tables WHERE table_name = ? AND table_type = 'VIEW'", [name]
+    ).fetchone() is not None
+    if exists and row is not None and row[0] == sig:
+        return
+    con.execute(f"CREATE OR REPLACE VIEW {name} AS {body_sql}")
+    con.execute(
+        "INSERT INTO etl_state VALUES (?, ?) ON CONFLICT (key) DO UPDATE SET value = excluded.value",
+        [f"view:{name}", sig],
+    )
+
 def ensure_v_dividend_flows(con: duckdb.DuckDBPyConnection) -> None:
     """
     Creates/refreshes a view that summarizes annual dividend flows by account,
     using security_dim.dividend_yield and security_dim.qualified_ratio.
 
-    It reads tax_rate_working / tax_rate_retirement from TEMP table retirement_globals
+    It reads tax_rate_working / tax_rate_retirement from TEMP view retirement_globals
     (registered from the parsed CSV in __main__).
     """
-    con.execute("""
-    CREATE OR REPLACE VIEW v_dividend_flows AS
-    WITH latest AS (
-      SELECT
-        p.*,
-        ROW_NUMBER() OVER (
-          PARTITION BY p.account_id, p.symbol
-          ORDER BY p.as_of_date DESC
-        ) AS rn
-      FROM positions_enriched p
-    ),
+    create_view_if_changed(con, "v_dividend_flows", """
+    WITH
     j AS (
       SELECT
         a.account_id,
@@ -86,11 +101,10 @@ def ensure_v_dividend_flows(con: duckdb.DuckDBPyConnection) -> None:
         s.dividend_yield,
         COALESCE(s.qualified_ratio, 0.0)          AS qualified_ratio,
         SUM(l.value)                              AS value
-      FROM latest l
+      FROM latest_positions l
       LEFT JOIN security_dim s ON s.symbol = l.symbol
       LEFT JOIN account_dim a  ON a.account_id = l.account_id
-      WHERE l.rn = 1
-        AND COALESCE(a.include_networth, TRUE)
+      WHERE COALESCE(a.include_networth, TRUE)
         AND s.dividend_yield IS NOT NULL
       GROUP BY 1,2,3,4,5,6,7
     ),
@@ -127,9 +141,10 @@ def ensure_v_dividend_flows_by_year(con):
     - Uses ret_inflows (already filtered to contributions in Python) as the source of investable cash.
     - Maps contributions by account_id if present; else by name via applies_to or Variable.
     """
+    # Inputs for the roll-forward, as TEMP views so both Python and the final view can read them
     con.execute("""
-    CREATE OR REPLACE VIEW v_dividend_flows_by_year AS
-    WITH RECURSIVE
+    CREATE OR REPLACE TEMP VIEW ret_params AS
+    WITH
     -- 1) Params (cast first, then coalesce)
     raw AS (
       SELECT
@@ -207,41 +222,33 @@ def ensure_v_dividend_flows_by_year(con):
         ) AS end_year
       FROM raw
     )
-,
-
-    -- 2) Latest positions & account-level weighted yield/qualified mix (today)
-    latest AS (
-      SELECT p.*,
-             ROW_NUMBER() OVER (PARTITION BY p.account_id, p.symbol ORDER BY p.as_of_date DESC) rn
-      FROM positions_enriched p
-    ),
-    acct_holdings AS (
-      SELECT
-        a.account_id,
-        a.account_name,
-        a.acct_group,
-        a.tax_bucket,
-        l.symbol,
-        SUM(l.value) AS value
-      FROM latest l
-      JOIN account_dim a ON a.account_id = l.account_id
-      WHERE l.rn = 1
-        AND COALESCE(a.include_networth, TRUE)
-      GROUP BY 1,2,3,4,5
-    ),
-    acct_yield AS (
-      SELECT
-        h.account_id,
-        MAX(h.account_name) AS account_name,
-        MAX(h.acct_group)   AS acct_group,
-        MAX(h.tax_bucket)   AS tax_bucket,
-        SUM(h.value * COALESCE(s.dividend_yield,0.0)) / NULLIF(SUM(h.value),0)  AS w_div_yield,
-        SUM(h.value * COALESCE(s.qualified_ratio,0.0)) / NULLIF(SUM(h.value),0) AS w_q_ratio
-      FROM acct_holdings h
-      LEFT JOIN security_dim s ON s.symbol = h.symbol
-      GROUP BY 1
-    ),
-
+    SELECT * FROM params
+    """)
+    con.execute("""
+    CREATE OR REPLACE TEMP VIEW ret_acct_holdings AS
+    -- 2) Latest positions (latest_positions) per account/symbol, today
+    SELECT
+      a.account_id,
+      a.account_name,
+      a.acct_group,
+      a.tax_bucket,
+      l.symbol,
+      SUM(l.value) AS value
+    FROM latest_positions l
+    JOIN account_dim a ON a.account_id = l.account_id
+    WHERE COALESCE(a.include_networth, TRUE)
+    GROUP BY 1,2,3,4,5
+    """)
+    # account_id (exact) and lower(account_name) -> account_id, for contribution mapping
+    con.execute("""
+    CREATE OR REPLACE TEMP TABLE account_lookup AS
+    SELECT account_id AS key, account_id, FALSE AS by_name FROM account_dim WHERE account_id IS NOT NULL
+    UNION ALL
+    SELECT LOWER(account_name), account_id, TRUE FROM account_dim WHERE account_name IS NOT NULL
+    """)
+    con.execute("""
+    CREATE OR REPLACE TEMP VIEW ret_investable_contribs AS
+    WITH
     -- 3) Investable contributions mapped to accounts (yearly)
     --    We’ll accept ANY of: account_id, applies_to, or Variable as the account key.
     infl_norm AS (
@@ -252,74 +259,69 @@ def ensure_v_dividend_flows_by_year(con):
         /* Pick up all potential account keys from the inflow row */
         NULLIF(TRIM(account_id), '')   AS account_id_text,
         NULLIF(TRIM(applies_to), '')   AS applies_to_text,
-        NULLIF(TRIM(Variable),   '')   AS variable_text
+        NULLIF(TRIM(Variable),   '')   AS variable_text,
+        ROW_NUMBER() OVER ()           AS rid
       FROM ret_inflows
+      WHERE TRY_CAST(Year AS INTEGER) IS NOT NULL
+        AND TRY_CAST(Value AS DOUBLE) IS NOT NULL
+        AND TRY_CAST(Value AS DOUBLE) <> 0
+    ),
+
+    -- One probe of account_lookup per candidate key instead of five joins against account_dim.
+    -- Priority (lowest wins) matches the old COALESCE order:
+    --   0 account_id col = id, 1 Variable = id, 2 applies_to = id,
+    --   3 Variable = name (case-insensitive), 4 applies_to = name (case-insensitive)
+    candidates AS (
+      SELECT rid, year, amount, account_id_text     AS key, FALSE AS by_name, 0 AS prio FROM infl_norm
+      UNION ALL SELECT rid, year, amount, variable_text,        FALSE, 1 FROM infl_norm
+      UNION ALL SELECT rid, year, amount, applies_to_text,      FALSE, 2 FROM infl_norm
+      UNION ALL SELECT rid, year, amount, LOWER(variable_text), TRUE,  3 FROM infl_norm
+      UNION ALL SELECT rid, year, amount, LOWER(applies_to_text), TRUE, 4 FROM infl_norm
     ),
 
     investable_contribs AS (
-      SELECT
-        /* prefer explicit account_id; else match Variable/applies_to to either account_id OR account_name */
-        COALESCE(a_id.account_id, a_var_id.account_id, a_app_id.account_id,
-                a_var_name.account_id, a_app_name.account_id) AS account_id,
-        n.year,
-        SUM(COALESCE(n.amount,0.0)) AS amount
-      FROM infl_norm n
-      /* 1) exact account_id from column */
-      LEFT JOIN account_dim a_id
-        ON a_id.account_id = n.account_id_text
-
-      /* 2) Variable matches account_id */
-      LEFT JOIN account_dim a_var_id
-        ON a_var_id.account_id = n.variable_text
-
-      /* 3) applies_to matches account_id */
-      LEFT JOIN account_dim a_app_id
-        ON a_app_id.account_id = n.applies_to_text
-
-      /* 4) Variable matches account_name (case-insensitive) */
-      LEFT JOIN account_dim a_var_name
-        ON LOWER(a_var_name.account_name) = LOWER(n.variable_text)
-
-      /* 5) applies_to matches account_name (case-insensitive) */
-      LEFT JOIN account_dim a_app_name
-        ON LOWER(a_app_name.account_name) = LOWER(n.applies_to_text)
-
-      WHERE n.year IS NOT NULL
-        AND n.amount IS NOT NULL
-        AND n.amount <> 0
-        AND COALESCE(a_id.account_id, a_var_id.account_id, a_app_id.account_id,
-                    a_var_name.account_id, a_app_name.account_id) IS NOT NULL
+      SELECT account_id, year, SUM(COALESCE(amount,0.0)) AS amount
+      FROM (
+        SELECT c.rid, c.year, c.amount, arg_min(l.account_id, c.prio) AS account_id
+        FROM candidates c
+        JOIN account_lookup l ON l.key = c.key AND l.by_name = c.by_name
+        GROUP BY 1,2,3
+      )
       GROUP BY 1,2
     )
-    ,
+    SELECT * FROM investable_contribs
+    """)
+
+    set_param_variables(con)
+    build_projected_values(con)
+
+    create_view_if_changed(con, "v_dividend_flows_by_year", """
+    WITH
+    -- Scalars (start/end/retirement year, tax rates) come from session variables set by
+    -- set_param_variables(), so they fold as constants instead of a CROSS JOIN params.
+    acct_holdings AS (SELECT * FROM ret_acct_holdings),
 
-    -- 4) Starting values per account (today)
-    start_values AS (
-      SELECT account_id, SUM(value) AS start_value
-      FROM acct_holdings
+    acct_yield AS (
+      SELECT
+        h.account_id,
+        MAX(h.account_name) AS account_name,
+        MAX(h.acct_group)   AS acct_group,
+        MAX(h.tax_bucket)   AS tax_bucket,
+        SUM(h.value * COALESCE(s.dividend_yield,0.0)) / NULLIF(SUM(h.value),0)  AS w_div_yield,
+        SUM(h.value * COALESCE(s.qualified_ratio,0.0)) / NULLIF(SUM(h.value),0) AS w_q_ratio
+      FROM acct_holdings h
+      LEFT JOIN security_dim s ON s.symbol = h.symbol
       GROUP BY 1
     ),
 
     -- 5) Year rows (materialize, not list)
     years AS (
       SELECT y AS year
-      FROM params p, range(p.start_year, p.end_year + 1) AS t(y)
+      FROM range(getvariable('ret_start_year'), getvariable('ret_end_year') + 1) AS t(y)
     ),
 
-    -- 6) Recursive roll-forward per account:
-    --    V[t] = (V[t-1] + contrib[t]) * (1 + g)
-    pv(account_id, year, value) AS (
-      SELECT s.account_id, p.start_year AS year, COALESCE(s.start_value, 0.0) AS value
-      FROM start_values s, params p
-      UNION ALL
-      SELECT pv.account_id,
-             pv.year + 1,
-             ( pv.value + COALESCE(c.amount, 0.0) ) * (1.0 + p.g)
-      FROM pv
-      JOIN params p ON pv.year < p.end_year
-      LEFT JOIN investable_contribs c
-        ON c.account_id = pv.account_id AND c.year = pv.year + 1
-    ),
+    -- Projected values per account/year (roll-forward computed in Python, see build_projected_values)
+    pv AS (SELECT account_id, year, value FROM ret_projected_values),
 
     -- 7) Compose per-year dividend math off projected values
     divs AS (
@@ -332,12 +334,29 @@ def ensure_v_dividend_flows_by_year(con):
         pv.value                 AS portfolio_value,
         a.w_div_yield            AS div_yield_w,
         a.w_q_ratio              AS q_ratio,
-        CASE WHEN y.year < p.retirement_year THEN p.tax_work ELSE p.tax_ret END AS eff_ord_rate,
+        CASE WHEN y.year < getvariable('ret_retirement_year')
+             THEN getvariable('ret_tax_work') ELSE getvariable('ret_tax_ret') END AS eff_ord_rate,
         0.15 AS qd_rate
       FROM years y
-      CROSS JOIN params p
       JOIN pv         ON pv.year = y.year
       JOIN acct_yield a ON a.account_id = pv.account_id
+    ),
+
+    -- 8) Gross and the three after-tax keep factors, each computed once per row
+    divs2 AS (
+      SELECT
+        d.*,
+        d.portfolio_value * COALESCE(d.div_yield_w,0.0) AS gross,
+        COALESCE(d.q_ratio,0.0)                         AS qr
+      FROM divs d
+    ),
+    divs3 AS (
+      SELECT
+        d.*,
+        1.0 - ( (1.0 - d.qr) * d.eff_ord_rate + d.qr * d.qd_rate ) AS f_by_year,
+        1.0 - ( (1.0 - d.qr) * getvariable('ret_tax_work') + d.qr * 0.15 ) AS f_work,
+        1.0 - ( (1.0 - d.qr) * getvariable('ret_tax_ret')  + d.qr * 0.15 ) AS f_ret
+      FROM divs2 d
     )
     SELECT
       d.year,
@@ -347,20 +366,58 @@ def ensure_v_dividend_flows_by_year(con):
       d.tax_bucket,
       d.portfolio_value,                                  -- NEW
       d.div_yield_w            AS dividend_yield_weighted,-- NEW
-      (d.portfolio_value * COALESCE(d.div_yield_w,0.0)) AS dividends_gross,
-      (d.portfolio_value * COALESCE(d.div_yield_w,0.0)
-        * (1.0 - ( (1.0 - COALESCE(d.q_ratio,0.0)) * d.eff_ord_rate
-                  + COALESCE(d.q_ratio,0.0) * d.qd_rate ))) AS dividends_net_by_year,  -- <- KEEP
-      (d.portfolio_value * COALESCE(d.div_yield_w,0.0)
-        * (1.0 - ( (1.0 - COALESCE(d.q_ratio,0.0)) * (SELECT tax_work FROM params)
-                  + COALESCE(d.q_ratio,0.0) * 0.15 ))) AS dividends_net_working,
-      (d.portfolio_value * COALESCE(d.div_yield_w,0.0)
-        * (1.0 - ( (1.0 - COALESCE(d.q_ratio,0.0)) * (SELECT tax_ret FROM params)
-                  + COALESCE(d.q_ratio,0.0) * 0.15 ))) AS dividends_net_retirement
-    FROM divs d
+      d.gross                  AS dividends_gross,
+      d.gross * d.f_by_year    AS dividends_net_by_year,  -- <- KEEP
+      d.gross * d.f_work       AS dividends_net_working,
+      d.gross * d.f_ret        AS dividends_net_retirement
+    FROM divs3 d
     ORDER BY d.year, d.account_name;
     """)
 
+def set_param_variables(con: duckdb.DuckDBPyConnection) -> None:
+    """Publish the one-row ret_params as DuckDB session variables (ret_<name>) for v_dividend_flows_by_year."""
+    row = con.execute(
+        "SELECT start_year, end_year, retirement_year, tax_work, tax_ret FROM ret_params"
+    ).fetchone()
+    for name, value in zip(["start_year", "end_year", "retirement_year", "tax_work", "tax_ret"], row):
+        con.execute(f"SET VARIABLE ret_{name} = ?", [value])
+
+def build_projected_values(con: duckdb.DuckDBPyConnection) -> None:
+    """
+    Roll each account forward from today's value with the _kernels.rollforward kernel:
+      V[start_year] = start value;  V[t] = (V[t-1] + contrib[t]) * (1 + g)
+    Result lands in TEMP TABLE ret_projected_values(account_id, year, value).
+    """
+    start_year, end_year, g = con.execute("SELECT start_year, end_year, g FROM ret_params").fetchone()
+    starts = con.execute("""
+        SELECT account_id, COALESCE(SUM(value), 0.0) AS start_value
+        FROM ret_acct_holdings
+        GROUP BY 1
+        ORDER BY 1
+    """).fetchdf()
+    contribs = con.execute("SELECT account_id, year, amount FROM ret_investable_contribs").fetchdf()
+
+    n_years = max(end_year - start_year + 1, 1)
+    acct_pos = {a: i for i, a in enumerate(starts["account_id"])}
+    contrib_mat = np.zeros((len(starts), n_years))
+    if not contribs.empty:
+        rows = contribs["account_id"].map(acct_pos)
+        cols = contribs["year"] - start_year
+        ok = rows.notna() & (cols >= 0) & (cols < n_years)
+        contrib_mat[rows[ok].astype(int).to_numpy(), cols[ok].astype(int).to_numpy()] = contribs.loc[ok, "amount"].to_numpy(dtype=float)
+
+    values = rollforward(starts["start_value"].to_numpy(dtype=float), contrib_mat, float(g))
+
+    proj = pd.DataFrame({
+        "account_id": np.repeat(starts["account_id"].to_numpy(), n_years),
+        "year": np.tile(np.arange(start_year, start_year + n_years), len(starts)),
+        "value": values.ravel(),
+    })
+    con.register("ret_projected_values_df", proj)
+    con.execute("CREATE OR REPLACE TEMP TABLE ret_projected_values AS SELECT * FROM ret_projected_values_df")
+    con.unregister("ret_projected_values_df")
+
+
 def looks_like_rate(var: str) -> bool:
     var_lower = (var or "").lower()
     return (
@@ -370,54 +427,54 @@ def looks_like_rate(var: str) -> bool:
         or var_lower.endswith("_percentage")
     )
 
+RATE_SUFFIX_RE = r"(?:_rate|_pct|_percentage)$"
+
+def rate_mask(variables: pd.Series) -> np.ndarray:
+    """Vectorized looks_like_rate over a whole Variable column."""
+    vl = variables.fillna("").astype(str).str.lower()
+    return (vl.isin(RATE_VAR_HINTS) | vl.str.contains(RATE_SUFFIX_RE, regex=True)).to_numpy(dtype=bool)
+
 def sanitize_columns(df: pd.DataFrame) -> pd.DataFrame:
     df = df.rename(columns={c: c.strip().replace(" ", "_") for c in df.columns})
     for col in ["Category","Variable","Value","Start_Year","Duration"]:
         if col not in df.columns:
             df[col] = np.nan
-    df = df.replace({"": np.nan, "NA": np.nan, "None": np.nan})
+    # Only the columns the expansion reads need blank/"NA"/"None" -> NaN; no whole-frame replace
+    for col in ("Value", "Start_Year"):
+        df[col] = pd.to_numeric(df[col], errors="coerce")
+    dur = df["Duration"].astype(str).str.strip()
+    df["Duration"] = df["Duration"].where(~dur.isin(["", "NA", "None"]))
+    for col in ("Category", "Variable"):
+        df[col] = df[col].where(~df[col].isin(["", "NA", "None"]))
     return df
 
-def parse_value(var: str, val) -> Tuple[float, bool]:
-    if pd.isna(val):
-        v = np.nan
-    else:
-        v = float(val)
-    return v, looks_like_rate(var)
-
-def resolve_end_year(start_year, duration, globals_map: Dict[str, Any]) -> int:
-    if pd.isna(start_year):
-        return np.nan
-    start_year = int(start_year)
-    if pd.isna(duration):
-        return start_year
-    dur_str = str(duration).strip().lower()
-    if dur_str == "lifetime":
-        death_year = int(globals_map.get("death_year"))
-        return death_year
-    years = int(dur_str)
-    return start_year + years - 1
-
 def inflate_series(amount_today: float, start_year: int, end_year: int, inflation_rate: float):
     years = list(range(start_year, end_year + 1))
-    idx = np.arange(len(years))
-    series = pd.Series(amount_today * np.power(1.0 + inflation_rate, idx), index=years, dtype=float)
+    series = pd.Series(amount_today * inflation_curve(len(years), inflation_rate), index=years, dtype=float)
     return series
 
-def load_retirement_assumptions(path: str):
-    
-    df = pd.read_csv(path)
+def load_retirement_assumptions(path: str, con: duckdb.DuckDBPyConnection | None = None):
+    """
+    Parse the assumptions CSV into (globals DataFrame, inflows / outflows Arrow tables).
+    With a connection, DuckDB parses the file once into TEMP TABLE retirement_src, which
+    __main__ then reuses as retirement_globals; without one, pandas reads it.
+    """
+    if con is not None:
+        con.execute("CREATE OR REPLACE TEMP TABLE retirement_src AS SELECT * FROM read_csv_auto(?, HEADER=TRUE)", [str(path)])
+        df = con.table("retirement_src").df()
+    else:
+        df = pd.read_csv(path)
     df = sanitize_columns(df)
 
     is_time_bound = df["Start_Year"].notna() | df["Duration"].notna()
     globals_rows = df.loc[~is_time_bound].copy()
     timed_rows = df.loc[is_time_bound].copy()
 
-    globals_map = {}
-    for _, r in globals_rows.iterrows():
-        var = str(r.get("Variable"))
-        val, is_rate = parse_value(var, r.get("Value"))
-        globals_map[var] = val
+    # later rows win, as before
+    globals_map = dict(zip(
+        globals_rows["Variable"].astype(str),
+        pd.to_numeric(globals_rows["Value"], errors="coerce").astype(float),
+    ))
 
     for must in ["inflation_rate","real_return_rate","death_year"]:
         if must not in globals_map or pd.isna(globals_map[must]):
@@ -427,94 +484,117 @@ def load_retirement_assumptions(path: str):
     base_year = int(globals_map.get("current_year", date.today().year))
     inflation_rate = float(globals_map["inflation_rate"])
 
-    inflows_records = []
-    outflows_records = []
-
-    for _, r in timed_rows.iterrows():
-        cat = (r.get("Category") or "").strip().lower()
-        var = str(r.get("Variable"))
-        val, is_rate = parse_value(var, r.get("Value"))
-        start_year = r.get("Start_Year")
-        end_year = resolve_end_year(start_year, r.get("Duration"), globals_map)
-
-        if pd.isna(start_year) or pd.isna(end_year):
-            globals_map[var] = val
-            continue
-
-        start_year = int(start_year); end_year = int(end_year)
-
-        name_lower = var.lower()
-        is_social_security = ("socialsecurity" in name_lower)
-        is_monthly = ("_monthly" in name_lower)
-
-        # ... inflation decision:
-        inflate = True if (cat == "withdrawal" or is_social_security) else False
-
-        # convert monthly → annual if you used *_monthly naming
-        if not is_rate and is_monthly:
-            val = val * 12.0
-
-        if is_rate:
-            years = list(range(start_year, end_year + 1))
-            series = pd.Series([val] * len(years), index=years, dtype=float)
-        else:
-            if inflate:
-                # PRE-INFLATE to start year, then continue inflating each year
-                years = list(range(start_year, end_year + 1))
-                # bring today's-dollars 'val' to nominal at start_year
-                start_nominal = float(val) * ((1.0 + inflation_rate) ** max(0, (start_year - base_year)))
-                idx = np.arange(len(years))
-                series = pd.Series(start_nominal * np.power(1.0 + inflation_rate, idx), index=years, dtype=float)
-            else:
-                years = list(range(start_year, end_year + 1))
-                series = pd.Series([val] * len(years), index=years, dtype=float)
-
-        for year, amt in series.items():
-            rec = {
-                "Year": int(year),
-                "Variable": var,
-                "Value": float(amt),
-            }
-            for opt in ["account_id","applies_to","Notes"]:
-                if opt in r and pd.notna(r[opt]):
-                    rec[opt] = r[opt]
-            if cat == "contribution":
-                inflows_records.append(rec)
-            elif cat == "withdrawal":
-                outflows_records.append(rec)
-
-    inflows_df = pd.DataFrame(inflows_records, columns=["Year","Variable","Value","account_id","applies_to","Notes"]).fillna("")
-    outflows_df = pd.DataFrame(outflows_records, columns=["Year","Variable","Value","account_id","applies_to","Notes"]).fillna("")
+    out_cols = ["Year","Variable","Value","account_id","applies_to","Notes"]
+
+    # ---- timed rows, vectorized: one output row per (assumption, year) ----
+    t = timed_rows.reset_index(drop=True)
+    var = t["Variable"].astype(str)
+    var_lower = var.str.lower()
+    val = pd.to_numeric(t["Value"], errors="coerce").to_numpy(dtype=float)
+    start = pd.to_numeric(t["Start_Year"], errors="coerce").to_numpy(dtype=float)
+
+    dur_str = t["Duration"].astype(str).str.strip().str.lower()
+    is_lifetime = (dur_str == "lifetime").to_numpy()
+    dur_num = pd.to_numeric(t["Duration"], errors="coerce").to_numpy(dtype=float)
+    bad_dur = t["Duration"].notna().to_numpy() & ~is_lifetime & np.isnan(dur_num)
+    if bad_dur.any():
+        raise ValueError(f"Unrecognized Duration values in {path}: {sorted(set(t.loc[bad_dur, 'Duration'].astype(str)))}")
+
+    # Rows without a usable Start_Year behave like globals (later rows win)
+    no_start = np.isnan(start)
+    for v, x in zip(var[no_start], val[no_start]):
+        globals_map[v] = x
+
+    death_year = float(globals_map["death_year"])
+    end = np.where(is_lifetime, death_year, np.where(np.isnan(dur_num), start, start + dur_num - 1))
+
+    cat = t["Category"].fillna("").astype(str).str.strip().str.lower().to_numpy()
+    keep = ~no_start & np.isin(cat, ["contribution", "withdrawal"])
+
+    is_rate = rate_mask(t["Variable"])
+    is_monthly = var_lower.str.contains("_monthly", regex=False).to_numpy()
+    is_ss = var_lower.str.contains("socialsecurity", regex=False).to_numpy()
+    inflate = ~is_rate & ((cat == "withdrawal") | is_ss)
+
+    # convert monthly -> annual if you used *_monthly naming
+    val = np.where(~is_rate & is_monthly, val * 12.0, val)
+
+    kept = np.flatnonzero(keep)
+    sub_rows, years, values = expand_timed_rows(
+        start[kept].astype(np.int64), end[kept].astype(np.int64),
+        val[kept], inflate[kept], base_year, inflation_rate,
+    )
+    rows = kept[sub_rows]
+
+    # Build each output table straight from gathered column arrays (Arrow, no intermediate DataFrame)
+    var_arr = var.to_numpy()
+    opt_arrs = {opt: (t[opt].to_numpy() if opt in t.columns else None)
+                for opt in ["account_id","applies_to","Notes"]}
+    row_cat = cat[rows]
+
+    def text_array(arr) -> pa.Array:
+        return pa.array(pd.array(arr, dtype="string"))  # mixed/NaN object values -> string / null
+
+    def flows_table(category: str) -> pa.Table:
+        sel = np.flatnonzero(row_cat == category)
+        src = rows[sel]
+        cols = {"Year": pa.array(years[sel], type=pa.int32()), "Variable": text_array(var_arr[src]),
+                "Value": pa.array(values[sel], type=pa.float64())}
+        for opt, arr in opt_arrs.items():
+            cols[opt] = text_array(arr[src]) if arr is not None else pa.nulls(len(sel), pa.string())
+        cols["row_seq"] = pa.array(sel, type=pa.int64())  # source order, for ordered exports
+        return pa.table({c: cols[c] for c in out_cols + ["row_seq"]})
+
+    inflows_tbl = flows_table("contribution")
+    outflows_tbl = flows_table("withdrawal")
     globals_df = pd.DataFrame(
         [{"Variable": k, "Value": v} for k, v in globals_map.items()],
         columns=["Variable","Value"]
     )
 
-    return globals_df, inflows_df, outflows_df
+    return globals_df, inflows_tbl, outflows_tbl
+
+def copy_query(con: duckdb.DuckDBPyConnection, sql: str, outdir: str, name: str, fmt: str = "csv") -> str:
+    """COPY (sql) to ret_<name>.csv|parquet directly from DuckDB. Returns the path."""
+    path = f"{outdir}/{name}.{fmt}"
+    opts = "FORMAT PARQUET, COMPRESSION ZSTD" if fmt == "parquet" else "FORMAT CSV, HEADER, DELIMITER ','"
+    con.execute(f"COPY ({sql}) TO '{Path(path).as_posix()}' ({opts})")
+    return path
 
 if __name__ == "__main__":
     import argparse
     parser = argparse.ArgumentParser(description="Load retirement assumptions CSV and emit normalized tables.")
     parser.add_argument("--csv", required=True, help="Path to retirement_assumptions.csv")
     parser.add_argument("--outdir", default=".", help="Output directory for globals/inflows/outflows CSVs")
+    parser.add_argument("--format", choices=["csv", "parquet"], default="csv",
+                        help="Format for ret_inflows / ret_outflows / ret_dividend_flows_by_year (default: csv)")
     args = parser.parse_args()
 
-    g, inflow, outflow = load_retirement_assumptions(args.csv)
+    con = get_con()
+    ensure_latest_positions(con)
+    g, inflow, outflow = load_retirement_assumptions(args.csv, con)
     con.register("ret_inflows", inflow)
+    con.register("ret_outflows", outflow)
     g.to_csv(f"{args.outdir}/ret_globals.csv", index=False)
-    inflow.to_csv(f"{args.outdir}/ret_inflows.csv", index=False)
-    outflow.to_csv(f"{args.outdir}/ret_outflows.csv", index=False)
+    flow_cols = "Year, Variable, Value, account_id, applies_to, Notes"
+    inflow_path = copy_query(con, f"SELECT {flow_cols} FROM ret_inflows ORDER BY row_seq",
+                             args.outdir, "ret_inflows", args.format)
+    outflow_path = copy_query(con, f"SELECT {flow_cols} FROM ret_outflows ORDER BY row_seq",
+                              args.outdir, "ret_outflows", args.format)
 
     # New: expose globals inside DuckDB, then create the dividends view
-    con.execute("CREATE OR REPLACE TEMP TABLE retirement_globals AS SELECT * FROM read_csv_auto(?, HEADER=TRUE)", [str(args.csv)])
+    con.execute("CREATE OR REPLACE TEMP VIEW retirement_globals AS SELECT * FROM retirement_src")
     # (alternative) con.register("retirement_globals", g)
     ensure_v_dividend_flows(con)
 
     # Build the by-year projection view (dividends grow with nominal portfolio rate)
     ensure_v_dividend_flows_by_year(con)
+    # Materialize once: exports scan a physical table, and it stays queryable after this
+    # session ends (the view depends on this run's TEMP tables / variables)
+    con.execute("CREATE OR REPLACE TABLE t_dividend_flows_by_year AS SELECT * FROM v_dividend_flows_by_year")
 
-    # Optional export for Power BI
-    div_by_year = con.execute("""
+    # Optional export for Power BI (streamed by DuckDB straight to disk, no pandas round-trip)
+    div_by_year_path = copy_query(con, """
         SELECT
           year,
           account_name,
@@ -523,27 +603,26 @@ if __name__ == "__main__":
           portfolio_value,                 -- NEW
           dividend_yield_weighted,         -- NEW
           dividends_net_by_year            -- <- KEEP
-        FROM v_dividend_flows_by_year
+        FROM t_dividend_flows_by_year
         ORDER BY year, account_name
-    """).fetchdf()
-    div_by_year.to_csv(f"{args.outdir}/ret_dividend_flows_by_year.csv", index=False)
+    """, args.outdir, "ret_dividend_flows_by_year", args.format)
 
     # Optional: materialize a CSV Power BI can import directly
-    div_preview = con.execute("""
+    copy_query(con, """
         SELECT account_name, acct_group, tax_bucket,
                dividends_gross, dividends_net_working, dividends_net_retirement
         FROM v_dividend_flows
         ORDER BY account_name
-    """).fetchdf()
-    div_preview.to_csv(f"{args.outdir}/ret_dividend_flows.csv", index=False)
+    """, args.outdir, "ret_dividend_flows")
 
     # existing: balances
-    starting_balances_df.to_csv(f"{args.outdir}/ret_starting_balances.csv", index=False)
+    get_starting_balances(con).to_csv(f"{args.outdir}/ret_starting_balances.csv", index=False)
 
     print("Wrote:",
           f"{args.outdir}/ret_globals.csv",
-          f"{args.outdir}/ret_inflows.csv",
-          f"{args.outdir}/ret_outflows.csv",
+          inflow_path,
+          outflow_path,
+          div_by_year_path,
           f"{args.outdir}/ret_starting_balances.csv",
           f"{args.outdir}/ret_dividend_flows.csv")
 
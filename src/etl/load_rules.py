@@ -1,28 +1,61 @@
 # src/etl/load_rules.py
 from __future__ import annotations
+import hashlib
 import os
 from pathlib import Path
-import duckdb
-from dotenv import load_dotenv
 
-load_dotenv()
+from _db import get_con
 
 # Paths
 REPO_ROOT = Path(__file__).resolve().parents[2]
 RULES_DIR = Path(os.getenv("RULES_DIR", REPO_ROOT / "rules"))
-DATA_DIR  = Path(os.getenv("DATA_DIR", r"C:\Users\jo136\OneDrive\FinanceData"))
-DB_PATH   = Path(os.getenv("DUCKDB_PATH", DATA_DIR / "finance.duckdb"))
 
-con = duckdb.connect(str(DB_PATH))
+con = get_con()
+
+# Skip reloading a table when its CSV (mtime + size) and this script are unchanged since the last load.
+# FORCE_RULES=1 reloads everything.
+FORCE_RULES = os.getenv("FORCE_RULES", "0") == "1"
+SCRIPT_HASH = hashlib.sha1(Path(__file__).read_bytes()).hexdigest()[:12]
+
+con.execute("CREATE TABLE IF NOT EXISTS etl_state (key TEXT PRIMARY KEY, value TEXT)")
+
+def _csv_signature(csv_path: Path) -> str:
+    st = csv_path.stat()
+    return f"{st.st_mtime_ns}:{st.st_size}:{SCRIPT_HASH}"
+
+def csv_unchanged(csv_path: Path, table: str) -> bool:
+    if FORCE_RULES or con.execute(
+            "SELECT 1 FROM information_schema.tables WHERE table_name = ?", [table]).fetchone() is None:
+        return False
+    row = con.execute("SELECT value FROM etl_state WHERE key = ?", [f"rules:{table}"]).fetchone()
+    if row is not None and row[0] == _csv_signature(csv_path):
+        print(f"SKIP {table}: {csv_path.name} unchanged")
+        return True
+    return False
+
+def mark_loaded(csv_path: Path, table: str) -> None:
+    con.execute(
+        "INSERT INTO etl_state VALUES (?, ?) ON CONFLICT (key) DO UPDATE SET value = excluded.value",
+        [f"rules:{table}", _csv_signature(csv_path)],
+    )
 
-def load_csv_table(csv_path: Path, create_sql: str, table: str):
-    """Ensure table exists with expected schema, then replace rows from CSV."""
+def load_csv_table(csv_path: Path, table: str, schema: dict[str, str], key: str):
+    """Replace table with the CSV's rows cast to the expected schema (columns missing from the CSV -> NULL)."""
     if not csv_path.exists():
         print(f"SKIP {table}: {csv_path} not found")
         return
-    con.execute(create_sql)
-    con.execute(f"DELETE FROM {table}")
-    con.execute(f"INSERT INTO {table} BY NAME SELECT * FROM read_csv_auto(?, HEADER=TRUE)", [str(csv_path)])
+    if csv_unchanged(csv_path, table):
+        return
+    have = {r[0].lower(): r[0] for r in
+            con.execute("DESCRIBE SELECT * FROM read_csv_auto(?, HEADER=TRUE)", [str(csv_path)]).fetchall()}
+    select = ",\n".join(
+        f'CAST("{have[col]}" AS {typ}) AS {col}' if col in have else f"CAST(NULL AS {typ}) AS {col}"
+        for col, typ in schema.items())
+    # Swap in fresh storage instead of DELETE + INSERT; the table's own unique key comes back as an index
+    con.execute(f"CREATE OR REPLACE TABLE {table} AS SELECT {select} FROM read_csv_auto(?, HEADER=TRUE)",
+                [str(csv_path)])
+    con.execute(f"CREATE UNIQUE INDEX IF NOT EXISTS ux_{table} ON {table}({key})")
+    mark_loaded(csv_path, table)
     n = con.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
     print(f"Loaded {table}: {n} rows")
 
@@ -32,6 +65,8 @@ def load_category_dim():
     if not csv_path.exists():
         print(f"SKIP category_dim: {csv_path} not found")
         return
+    if csv_unchanged(csv_path, "category_dim"):
+        return
 
     # Recreate the table directly from the CSV to guarantee schema alignment
     con.execute("""
@@ -58,40 +93,44 @@ def load_category_dim():
     con.execute("CREATE UNIQUE INDEX IF NOT EXISTS ux_category_dim ON category_dim(category);")
     con.execute("CREATE INDEX IF NOT EXISTS ix_category_dim_parent ON category_dim(parent_category);")
 
+    mark_loaded(csv_path, "category_dim")
     n = con.execute("SELECT COUNT(*) FROM category_dim").fetchone()[0]
     print(f"Loaded category_dim: {n} rows")
 
 # 1) account_dim
 load_csv_table(
     RULES_DIR / "account_dim.csv",
-    """
-    CREATE TABLE IF NOT EXISTS account_dim (
-      account_id TEXT PRIMARY KEY,
-      account_name TEXT,
-      owner TEXT,
-      type TEXT,
-      acct_group TEXT,
-      tax_bucket TEXT,
-      liquidity TEXT,
-      include_networth BOOLEAN,
-      include_liquid BOOLEAN
-    )
-    """,
-    "account_dim"
+    "account_dim",
+    {
+        "account_id": "TEXT",
+        "account_name": "TEXT",
+        "owner": "TEXT",
+        "type": "TEXT",
+        "acct_group": "TEXT",
+        "tax_bucket": "TEXT",
+        "liquidity": "TEXT",
+        "include_networth": "BOOLEAN",
+        "include_liquid": "BOOLEAN",
+    },
+    key="account_id",
 )
 
-# 2) budget_monthly
-load_csv_table(
-    RULES_DIR / "budget_monthly.csv",
-    """
-    CREATE TABLE IF NOT EXISTS budget_monthly (
-      month DATE,
-      category TEXT,
-      amount DOUBLE
-    )
-    """,
-    "budget_monthly"
-)
+# 2) budget_monthly (amount stored as integer cents; full reload, so replace handles old schemas)
+budget_csv = RULES_DIR / "budget_monthly.csv"
+if not budget_csv.exists():
+    print(f"SKIP budget_monthly: {budget_csv} not found")
+elif not csv_unchanged(budget_csv, "budget_monthly"):
+    con.execute("""
+        CREATE OR REPLACE TABLE budget_monthly AS
+        SELECT
+          CAST(month AS DATE)                                 AS month,
+          TRIM(CAST(category AS VARCHAR))                     AS category,
+          CAST(ROUND(CAST(amount AS DOUBLE) * 100) AS BIGINT) AS amount_cents
+        FROM read_csv_auto(?, HEADER=TRUE)
+    """, [str(budget_csv)])
+    mark_loaded(budget_csv, "budget_monthly")
+    n = con.execute("SELECT COUNT(*) FROM budget_monthly").fetchone()[0]
+    print(f"Loaded budget_monthly: {n} rows")
 
 # 3) category_dim (no subcategory)
 load_category_dim()
@@ -99,52 +138,49 @@ load_category_dim()
 # 4) security_dim
 load_csv_table(
     RULES_DIR / "security_dim.csv",
-    """
-    CREATE TABLE IF NOT EXISTS security_dim (
-      symbol TEXT PRIMARY KEY,
-      asset_class TEXT,
-      region TEXT,
-      style TEXT,
-      size TEXT,
-      expense_ratio DECIMAL(9,6),
-      dividend_yield DOUBLE,
-      qualified_ratio DOUBLE
-    );
-    -- In case security_dim already existed without the new columns,
-    -- make the migration idempotent:
-    ALTER TABLE security_dim ADD COLUMN IF NOT EXISTS dividend_yield DOUBLE;
-    ALTER TABLE security_dim ADD COLUMN IF NOT EXISTS qualified_ratio DOUBLE;
-    """,
-    "security_dim"
+    "security_dim",
+    {
+        "symbol": "TEXT",
+        "asset_class": "TEXT",
+        "region": "TEXT",
+        "style": "TEXT",
+        "size": "TEXT",
+        "expense_ratio": "DECIMAL(9,6)",
+        "dividend_yield": "DOUBLE",
+        "qualified_ratio": "DOUBLE",
+    },
+    key="symbol",
 )
 
 # 5) target_allocation
 load_csv_table(
     RULES_DIR / "target_allocation.csv",
-    """
-    CREATE TABLE IF NOT EXISTS target_allocation (
-      asset_class TEXT PRIMARY KEY,
-      target_weight DOUBLE
-    )
-    """,
-    "target_allocation"
+    "target_allocation",
+    {
+        "asset_class": "TEXT",
+        "target_weight": "DOUBLE",
+    },
+    key="asset_class",
 )
 
 print("Rules loaded.")
 
-# 6) category_rules (always reload so CSV edits take effect)
+# 6) category_rules (reloaded when the CSV's mtime/size or this script changes; FORCE_RULES=1 forces it)
 catrules_csv = RULES_DIR / "category_rules.csv"
-if catrules_csv.exists():
+if not catrules_csv.exists():
+    print(f"SKIP category_rules: {catrules_csv} not found")
+elif not csv_unchanged(catrules_csv, "category_rules"):
     con.execute("CREATE OR REPLACE TABLE category_rules AS SELECT * FROM read_csv_auto(?, HEADER=TRUE)", [str(catrules_csv)])
     # Optional: light index to speed contains-matching (helps a bit for many rules)
     con.execute("CREATE INDEX IF NOT EXISTS ix_category_rules_pattern ON category_rules(pattern);")
+    mark_loaded(catrules_csv, "category_rules")
     print(f"Loaded category_rules from {catrules_csv}")
-else:
-    print(f"SKIP category_rules: {catrules_csv} not found")
 
 # 7) category_overrides (manual one-off categorization rules)
 overrides_csv = RULES_DIR / "category_overrides.csv"
-if overrides_csv.exists():
+if not overrides_csv.exists():
+    print(f"SKIP category_overrides: {overrides_csv} not found")
+elif not csv_unchanged(overrides_csv, "category_overrides"):
     con.execute("""
         CREATE TABLE IF NOT EXISTS category_overrides (
             active BOOLEAN,
@@ -185,9 +221,8 @@ if overrides_csv.exists():
     """, [str(overrides_csv)])
 
 
+    mark_loaded(overrides_csv, "category_overrides")
     n = con.execute("SELECT COUNT(*) FROM category_overrides").fetchone()[0]
     print(f"Loaded category_overrides: {n} rows")
-else:
-    print(f"SKIP category_overrides: {overrides_csv} not found")
 
 
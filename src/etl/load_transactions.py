@@ -1,204 +1,216 @@
 # Transactions loader (warnings removed: robust boolean parsing for is_transfer)
 from __future__ import annotations
-import os, re, glob, hashlib
+import csv, glob, os
 from pathlib import Path
-from typing import Dict, List
+from typing import Dict, List, Optional
 
 import duckdb
-import pandas as pd
-from dotenv import load_dotenv
 
-load_dotenv()
+from _db import DATA_DIR, get_con
+from init_db import TRANSACTIONS_COLUMNS, ensure_schema, ensure_txn_id_unique
 
-DATA_DIR = Path(os.getenv("DATA_DIR", r"C:\Users\jo136\OneDrive\FinanceData"))
-DB_PATH  = Path(os.getenv("DUCKDB_PATH", DATA_DIR / "finance.duckdb"))
 TXN_DIR  = DATA_DIR / "transactions" / "normalized"
 TXN_DIR.mkdir(parents=True, exist_ok=True)
 
-STOPWORDS = {"inc","inc.","llc","llc.","co","co.","corp","corp.","ltd","ltd.","the","store","stores","company","companies"}
-
-def normalize_merchant(text: str) -> str:
-    if not isinstance(text, str): return ""
-    t = re.sub(r"[^a-z0-9]+", " ", text.lower())
-    toks = [w for w in t.split() if w not in STOPWORDS]
-    return " ".join(toks).strip()
-
-def to_int_cents(x) -> int:
-    if pd.isna(x): return 0
-    if isinstance(x, str):
-        x = x.replace("$","").replace(",","").strip()
-    try:
-        return int(round(float(x) * 100))
-    except Exception:
-        return 0
-
-def flexible_rename(df: pd.DataFrame) -> pd.DataFrame:
-    mapping_candidates: Dict[str, List[str]] = {
-        "date":       ["date","Date","posted","Transaction Date"],
-        "description":["description","Description","merchant","Payee","Name"],
-        "amount":     ["amount","Amount","amount_usd","Amount (USD)","Amount USD"],
-        "account_id": ["account_id","Account","Account Id","AccountId","Acct"],
-        "category":   ["category","Category"],
-        "memo":       ["memo","Memo","Notes","Note"],
-        "tags":       ["tags","Tags"],
-        "is_transfer":["is_transfer","IsTransfer","Transfer"],
-    }
-    colmap = {}
-    lower_cols = {c.lower(): c for c in df.columns}
-    for target, candidates in mapping_candidates.items():
+STOPWORDS = frozenset({"inc","inc.","llc","llc.","co","co.","corp","corp.","ltd","ltd.","the","store","stores","company","companies"})
+
+COLUMN_CANDIDATES: Dict[str, List[str]] = {
+    "date":       ["date","Date","posted","Transaction Date"],
+    "description":["description","Description","merchant","Payee","Name"],
+    "amount":     ["amount","Amount","amount_usd","Amount (USD)","Amount USD"],
+    "account_id": ["account_id","Account","Account Id","AccountId","Acct"],
+    "category":   ["category","Category"],
+    "memo":       ["memo","Memo","Notes","Note"],
+    "tags":       ["tags","Tags"],
+    "is_transfer":["is_transfer","IsTransfer","Transfer"],
+}
+
+def resolve_columns(columns: List[str]) -> Dict[str, str]:
+    """Map each target column to the source header it comes from (exact name first, then case-insensitive)."""
+    exact = set(columns)
+    lower_cols = {c.lower(): c for c in columns}
+    colmap: Dict[str, str] = {}
+    for target, candidates in COLUMN_CANDIDATES.items():
         for cand in candidates:
-            if cand in df.columns:
-                colmap[cand] = target; break
-            lc = cand.lower()
-            if lc in lower_cols:
-                colmap[lower_cols[lc]] = target; break
-    return df.rename(columns=colmap)
-
-def compute_dup_seq(df: pd.DataFrame) -> pd.Series:
-    grp = df.groupby(["date","account_id","amount_cents","merchant_norm"], dropna=False)
-    return (grp.cumcount() + 1).astype("int64")
+            src = cand if cand in exact else lower_cols.get(cand.lower())
+            if src is not None:
+                colmap[target] = src
+                break
+    return colmap
+
+# All per-row derivation runs in DuckDB over the raw CSVs (TEMP TABLE raw, every column VARCHAR):
+# - amount_cents: strip $/, then round half-to-even like Python's round(); unparseable -> 0
+# - merchant_norm: lowercase, non [a-z0-9] runs -> space, drop STOPWORDS
+# - Chase 'ORIG CO' pending rows dropped only if a clean row in the same file shares (account_id, date, amount_cents)
+# - dup_seq: 1..n within (file, date, account_id, amount_cents, merchant_norm), in file order (rowid)
+# - txn_id: sha256 of date|account_id|amount_cents|merchant_norm|dup_seq
+# - a txn_id seen in several files keeps the row from the last file (what per-file MERGEs ended with)
+STAGE_SQL = """
+CREATE OR REPLACE TEMP TABLE staging AS
+WITH base AS (
+    SELECT
+        filename,
+        rowid AS rn,
+        COALESCE(TRY_CAST({date} AS DATE), CAST(TRY_CAST({date} AS TIMESTAMP) AS DATE)) AS date,
+        {account_id} AS account_id,
+        COALESCE(CAST(round_even(TRY_CAST(trim(regexp_replace({amount}, '[$,]', '', 'g')) AS DOUBLE) * 100, 0) AS BIGINT), 0)
+            AS amount_cents,
+        TRY_CAST({amount} AS DOUBLE) AS amount,
+        {description} AS description,
+        array_to_string(list_filter(
+            string_split(regexp_replace(lower(COALESCE({description}, '')), '[^a-z0-9]+', ' ', 'g'), ' '),
+            w -> w <> '' AND NOT list_contains($stopwords, w)), ' ') AS merchant_norm,
+        {category} AS category,
+        {memo} AS memo,
+        {tags} AS tags,
+        COALESCE(lower(trim({is_transfer})) IN ('1','true','t','yes','y'), FALSE) AS is_transfer,
+        COALESCE(upper({description}) LIKE '%ORIG CO%', FALSE) AS is_orig_co
+    FROM raw
+),
+kept AS (
+    SELECT * FROM base
+    WHERE date IS NOT NULL
+    QUALIFY NOT (is_orig_co
+                 AND bool_or(is_orig_co) OVER (PARTITION BY filename, account_id, date, amount_cents)
+                 AND NOT bool_and(is_orig_co) OVER (PARTITION BY filename, account_id, date, amount_cents))
+),
+seq AS (
+    SELECT *, row_number() OVER (PARTITION BY filename, date, account_id, amount_cents, merchant_norm ORDER BY rn) AS dup_seq
+    FROM kept
+),
+keyed AS (
+    SELECT *,
+        sha256(concat_ws('|', CAST(date AS VARCHAR), account_id, CAST(amount_cents AS VARCHAR),
+                         merchant_norm, CAST(dup_seq AS VARCHAR))) AS txn_id
+    FROM seq
+)
+SELECT txn_id, date, account_id, amount_cents, amount, description, merchant_norm, category, memo, tags, is_transfer
+FROM keyed
+QUALIFY row_number() OVER (PARTITION BY txn_id ORDER BY rn DESC) = 1
+"""
+
+def _quote(col: str) -> str:
+    return '"' + col.replace('"', '""') + '"'
+
+def _read_header(path: str) -> List[str]:
+    with open(path, newline="", encoding="utf-8-sig") as f:
+        return next(csv.reader(f), [])
+
+def _parquet_copies(paths: List[str]) -> Optional[List[str]]:
+    """
+    normalize_transactions writes a typed .parquet copy next to each CSV. Return them (same order)
+    when every CSV has one at least as new as itself, else None: a hand-edited or hand-dropped
+    CSV means the whole batch is read from the CSVs, so file order (and dup_seq / last-file-wins) is unchanged.
+    """
+    copies = [str(Path(p).with_suffix(".parquet")) for p in paths]
+    for csv_path, pq_path in zip(paths, copies):
+        if not os.path.exists(pq_path) or os.stat(pq_path).st_mtime_ns < os.stat(csv_path).st_mtime_ns:
+            return None
+    return copies
+
+def stage_files(con: duckdb.DuckDBPyConnection, paths: List[str]) -> int:
+    """Read all normalized files in one pass into TEMP TABLE staging with derived columns. Returns the row count."""
+    copies = _parquet_copies(paths)
+    # Headers differ between exports, so each target coalesces every source column any file maps to it
+    sources: Dict[str, List[str]] = {t: [] for t in COLUMN_CANDIDATES}
+    for path in copies or paths:
+        header = ([d[0] for d in con.execute("SELECT * FROM read_parquet(?) LIMIT 0", [path]).description]
+                  if copies else _read_header(path))
+        colmap = resolve_columns(header)
+        missing = {"date","description","amount","account_id"} - set(colmap)
+        if missing:
+            raise ValueError(f"{path} missing required columns: {missing}")
+        for t, col in colmap.items():
+            if col not in sources[t]:
+                sources[t].append(col)
 
-def make_txn_id(row: pd.Series) -> str:
-    key = f"{row['date']}|{row['account_id']}|{row['amount_cents']}|{row['merchant_norm']}|{row['dup_seq']}"
-    return hashlib.sha256(key.encode("utf-8")).hexdigest()
+    if copies:
+        # columnar read; cast to the all-VARCHAR shape the CSV read produces (blank text -> NULL, as in a CSV)
+        con.execute("""
+            CREATE OR REPLACE TEMP TABLE raw AS
+            SELECT NULLIF(CAST(COLUMNS(* EXCLUDE (filename)) AS VARCHAR), ''), filename
+            FROM read_parquet(?, union_by_name=TRUE, filename=TRUE)
+        """, [copies])
+    else:
+        con.execute("""
+            CREATE OR REPLACE TEMP TABLE raw AS
+            SELECT * FROM read_csv_auto(?, HEADER=TRUE, ALL_VARCHAR=TRUE, union_by_name=TRUE, filename=TRUE)
+        """, [paths])
+    exprs = {t: (cols[0] if len(cols) == 1 else f"COALESCE({', '.join(cols)})") if cols else "CAST(NULL AS VARCHAR)"
+             for t, cols in ((t, [_quote(c) for c in cs]) for t, cs in sources.items())}
+    con.execute(STAGE_SQL.format(**exprs), {"stopwords": sorted(STOPWORDS)})
+    con.execute("DROP TABLE raw")  # free the all-VARCHAR copy before the MERGE runs
+    return con.execute("SELECT COUNT(*) FROM staging").fetchone()[0]
 
 def _col_exists(con: duckdb.DuckDBPyConnection, table: str, col: str) -> bool:
     return con.execute(
         "SELECT 1 FROM information_schema.columns WHERE table_name = ? AND column_name = ? LIMIT 1",
         [table, col]).fetchone() is not None
 
-def _find_dependents(con: duckdb.DuckDBPyConnection, base: str) -> list[tuple[str,str]]:
-    rows = con.execute("SELECT * FROM duckdb_dependencies()").fetchdf()
-    deps: list[tuple[str,str]] = []
-    if rows is not None and len(rows) > 0:
-        for _, r in rows.iterrows():
-            if (str(r.get("dependson_name","")).lower() == base.lower() and
-                str(r.get("dependson_type","")).upper() in {"TABLE","VIEW"}):
-                deps.append((str(r.get("type","")).upper(), str(r.get("name",""))))
-    return deps
-
-def _drop_all_dependents(con: duckdb.DuckDBPyConnection, base: str = "transactions"):
-    seen = set()
-    queue = [base]
-    while queue:
-        target = queue.pop(0)
-        for kind,name in _find_dependents(con, target):
-            key = (kind,name)
-            if key in seen: 
-                continue
-            seen.add(key)
-            try:
-                con.execute(f"DROP {kind} IF EXISTS {name};")
-            except Exception:
-                pass
-            queue.append(name)
-
 def _migrate_drop_subcategory(con: duckdb.DuckDBPyConnection):
     if not _col_exists(con, "transactions", "subcategory"):
         return
-    _drop_all_dependents(con, "transactions")
-    pragma_df = con.execute("PRAGMA table_info('transactions')").fetchdf()
-    cols = [str(n) for n in pragma_df["name"].tolist() if n != "subcategory"]
-    select_list = ", ".join(cols)
-    con.execute(f"CREATE TABLE transactions__new AS SELECT {select_list} FROM transactions;")
-    con.execute("DROP TABLE transactions;")
-    con.execute("ALTER TABLE transactions__new RENAME TO transactions;")
-    con.execute("CREATE UNIQUE INDEX IF NOT EXISTS ux_transactions_txnid ON transactions(txn_id);")
-
-def _parse_is_transfer(series: pd.Series) -> pd.Series:
-    # Robust, warning-free conversion to bool
-    # Accepts 1/0, true/false, yes/no, y/n (case-insensitive). Anything else -> False.
-    s = pd.Series(series, dtype="string").str.strip().str.lower()
-    mask = s.isin(["1","true","t","yes","y"])
-    return mask.fillna(False).astype(bool)
+    # In-place column drop (no table copy, dependent views stay). DuckDB refuses ALTER while explicit
+    # indexes exist on the table (the primary key is fine), so drop those first and recreate them after.
+    indexes = con.execute(
+        "SELECT index_name, sql FROM duckdb_indexes() WHERE table_name = 'transactions'").fetchall()
+    for name, _ in indexes:
+        con.execute(f"DROP INDEX IF EXISTS {name}")
+    con.execute("ALTER TABLE transactions DROP COLUMN subcategory")
+    for _, sql in indexes:
+        con.execute(sql)
+
+def merge_staging(con: duckdb.DuckDBPyConnection) -> None:
+    """Upsert TEMP TABLE staging into transactions by txn_id."""
+    con.execute("""
+    MERGE INTO transactions t
+    USING staging s
+    ON t.txn_id = s.txn_id
+    WHEN MATCHED THEN UPDATE SET
+        date = s.date,
+        account_id = s.account_id,
+        amount_cents = s.amount_cents,
+        amount = s.amount,
+        description = s.description,
+        merchant_norm = s.merchant_norm,
+        category = s.category,
+        memo = s.memo,
+        tags = s.tags,
+        is_transfer = COALESCE(s.is_transfer, FALSE)
+    WHEN NOT MATCHED THEN INSERT (txn_id, date, account_id, amount_cents, amount,
+                                  description, merchant_norm, category, memo, tags, is_transfer)
+    VALUES (s.txn_id, s.date, s.account_id, s.amount_cents, s.amount,
+            s.description, s.merchant_norm, s.category, s.memo, s.tags,
+            COALESCE(s.is_transfer, FALSE));
+    """)
 
 def main() -> None:
-    con = duckdb.connect(str(DB_PATH))
-
-    con.execute("""    CREATE TABLE IF NOT EXISTS transactions (
-        txn_id TEXT PRIMARY KEY,
-        date DATE,
-        account_id TEXT,
-        amount_cents BIGINT,
-        amount DOUBLE,
-        description TEXT,
-        merchant_norm TEXT,
-        category TEXT,
-        memo TEXT,
-        tags TEXT,
-        is_transfer BOOLEAN DEFAULT FALSE
-    );
-    """)
+    con = get_con()
 
+    ensure_schema(con)
     _migrate_drop_subcategory(con)
+    ensure_txn_id_unique(con)  # migrate_001, on this connection
 
     csvs = sorted(glob.glob(str(TXN_DIR / "**" / "*.csv"), recursive=True))
     if not csvs:
         print(f"No transaction files found in: {TXN_DIR}"); return
 
-    total_rows = 0
-    for path in csvs:
-        df = pd.read_csv(path)
-        df = flexible_rename(df)
+    # dup_seq numbers duplicates in file order, which rowid only reflects when inserts keep their order
+    con.execute("SET preserve_insertion_order=true")
 
-        req = {"date","description","amount","account_id"}
-        missing = req - set(df.columns)
-        if missing:
-            raise ValueError(f"{path} missing required columns: {missing}")
+    total_rows = stage_files(con, csvs)
 
-        df["date"] = pd.to_datetime(df["date"], errors="coerce").dt.date
-        df = df[~df["date"].isna()]
-
-        df["amount_cents"] = df["amount"].apply(to_int_cents).astype("int64")
-        df["amount"] = pd.to_numeric(df["amount"], errors="coerce")
-        df["merchant_norm"] = df["description"].astype(str).apply(normalize_merchant)
-
-        # Drop Chase 'ORIG CO' pending rows only if a clean match exists
-        if "description" in df.columns:
-            df["is_orig_co"] = df["description"].str.upper().str.contains("ORIG CO", na=False)
-            # Within each (account_id, date, amount_cents) group, if both pending and non-pending exist → drop the pending one
-            dup_mask = (
-                df.groupby(["account_id", "date", "amount_cents"])["is_orig_co"]
-                .transform(lambda g: g.sum() > 0 and not all(g))
-            )
-            df = df[~(df["is_orig_co"] & dup_mask)]
-
-        df["dup_seq"] = compute_dup_seq(df)
-        df["txn_id"] = df.apply(make_txn_id, axis=1)
-
-        for col in ["category","memo","tags","is_transfer"]:
-            if col not in df.columns: df[col] = None
-        # warning-free conversion
-        df["is_transfer"] = _parse_is_transfer(df["is_transfer"])
-
-        out_cols = ["txn_id","date","account_id","amount_cents","amount",
-                    "description","merchant_norm","category","memo","tags","is_transfer"]
-        df = df[out_cols]
-        total_rows += len(df)
-
-        con.register("staging_df", df)
-        con.execute("""        MERGE INTO transactions t
-        USING staging_df s
-        ON t.txn_id = s.txn_id
-        WHEN MATCHED THEN UPDATE SET
-            date = s.date,
-            account_id = s.account_id,
-            amount_cents = s.amount_cents,
-            amount = s.amount,
-            description = s.description,
-            merchant_norm = s.merchant_norm,
-            category = s.category,
-            memo = s.memo,
-            tags = s.tags,
-            is_transfer = COALESCE(s.is_transfer, FALSE)
-        WHEN NOT MATCHED THEN INSERT (txn_id, date, account_id, amount_cents, amount,
-                                      description, merchant_norm, category, memo, tags, is_transfer)
-        VALUES (s.txn_id, s.date, s.account_id, s.amount_cents, s.amount,
-                s.description, s.merchant_norm, s.category, s.memo, s.tags,
-                COALESCE(s.is_transfer, FALSE));
-            """)
-
-            # After loading all files, drop ORIG CO pending rows that have a same-day settled match
+    # Upsert + ORIG CO cleanup commit together (one WAL flush; a failure leaves the table untouched)
+    con.execute("BEGIN TRANSACTION")
+    try:
+        if con.execute("SELECT COUNT(*) = 0 FROM transactions").fetchone()[0]:
+            # Cold load: nothing to match against, so skip the MERGE join and insert straight from staging
+            con.execute(f"INSERT INTO transactions ({', '.join(TRANSACTIONS_COLUMNS)}) "
+                        f"SELECT {', '.join(TRANSACTIONS_COLUMNS)} FROM staging")
+        else:
+            merge_staging(con)
+
+        # After loading all files, drop ORIG CO pending rows that have a same-day settled match
         con.execute("""
         WITH annotated AS (
             SELECT
@@ -225,7 +237,11 @@ def main() -> None:
         DELETE FROM transactions
         WHERE txn_id IN (SELECT txn_id FROM dupe_candidates);
         """)
-        
+        con.execute("COMMIT")
+    except Exception:
+        con.execute("ROLLBACK")
+        raise
+
     cnt = con.execute("SELECT COUNT(*) FROM transactions").fetchone()[0]
     print(f"Transactions MERGE complete. Table rows: {cnt} (processed {total_rows} staged rows across {len(csvs)} files)")
 
@@ -2,21 +2,19 @@
 Migration 001: enforce uniqueness of transactions.txn_id.
 
 Adds:
-- UNIQUE INDEX ux_transactions_txn_id ON transactions(txn_id)
+- UNIQUE INDEX ux_transactions_txn_id ON transactions(txn_id), unless txn_id is
+  already the primary key (tables created by init_db.ensure_schema)
+
+load_transactions.py and load_csv.py now ensure this themselves; running it
+by hand is only needed for other writers.
 
 Run once (safe to re-run):
     python src/etl/migrate_001_add_unique_txn_id.py
 """
 
-import os
-from pathlib import Path
-import duckdb
-from dotenv import load_dotenv
-
-load_dotenv()
-DB = Path(os.getenv("DATA_DIR", r"C:\Users\jo136\OneDrive\FinanceData")) / "finance.duckdb"
+from _db import get_con
+from init_db import ensure_txn_id_unique
 
-with duckdb.connect(str(DB)) as con:
-    con.execute("CREATE UNIQUE INDEX IF NOT EXISTS ux_transactions_txn_id ON transactions(txn_id);")
+ensure_txn_id_unique(get_con())
 
 print("Unique index ensured on transactions.txn_id.")
@@ -0,0 +1,36 @@
+"""
+Migration 002: re-key transactions loaded by load_csv.py from SHA-1 to BLAKE2b txn_ids.
+
+Re-reads DATA_DIR/sample_transactions.csv, computes the old (SHA-1) and new
+(BLAKE2b) id for every row, and rewrites matching txn_ids in place so the
+next load_csv.py run still hits ON CONFLICT instead of inserting duplicates.
+
+Run once (safe to re-run; already re-keyed rows simply don't match):
+    python src/etl/migrate_002_blake2b_txn_id.py
+"""
+
+import pandas as pd
+
+from _db import get_con
+from load_csv import CSV, normalize, legacy_sha1_txn_id
+
+if not CSV.exists():
+    raise SystemExit(f"Missing CSV: {CSV}")
+
+raw = pd.read_csv(CSV)
+id_map = pd.DataFrame({
+    "old_id": normalize(raw, hasher=legacy_sha1_txn_id)["txn_id"],
+    "new_id": normalize(raw)["txn_id"],
+})
+
+con = get_con()
+con.register("id_map", id_map)
+n = con.execute("SELECT COUNT(*) FROM transactions t JOIN id_map m ON t.txn_id = m.old_id").fetchone()[0]
+con.execute("""
+    UPDATE transactions AS t
+    SET txn_id = m.new_id
+    FROM id_map m
+    WHERE t.txn_id = m.old_id
+""")
+
+print(f"Re-keyed {n} transactions from SHA-1 to BLAKE2b txn_id.")
@@ -2,10 +2,13 @@
 r"""
 Normalize raw positions into canonical CSV:
   as_of_date, account_id, symbol, shares, price, market_value
-Outputs mirror raw path: positions/normalized/<vendor>/<route>/positions_<date>.csv
+Outputs mirror raw path: positions/normalized/<vendor>/<route>/positions_<date>.csv (+ .parquet copy)
 """
-import os, re, glob
+import os, re
+from concurrent.futures import ProcessPoolExecutor
+from datetime import date
 from pathlib import Path
+import numpy as np
 import pandas as pd
 from dotenv import load_dotenv
 
@@ -27,37 +30,45 @@ ACCOUNT_ID_OVERRIDES = {
     # add more like: ("fidelity", "roth"): "ROTH_JON"
 }
 
-def _num(x):
-    if pd.isna(x): return None
-    s = str(x).strip().replace(",", "").replace("$", "")
-    # parentheses = negative
-    neg = s.startswith("(") and s.endswith(")")
-    s = s.strip("()").strip()
-    try:
-        v = float(s)
-        return -v if neg else v
-    except Exception:
-        return None
+def _num_series(s: pd.Series) -> pd.Series:
+    """'$1,234.50' / '(12.00)' / 12.5 -> float (parentheses = negative); unparseable -> NaN. Vectorized."""
+    t = s.astype("string").str.strip().str.replace(",", "", regex=False).str.replace("$", "", regex=False)
+    neg = (t.str.startswith("(") & t.str.endswith(")")).fillna(False).astype(bool)
+    v = pd.to_numeric(t.str.strip("()").str.strip(), errors="coerce").astype(float)
+    return v.where(~neg, -v)
+
+def _coerce_float(out: pd.DataFrame, cols) -> None:
+    """pd.to_numeric(errors="coerce") in place, skipping columns that are float already."""
+    for c in cols:
+        if not pd.api.types.is_float_dtype(out[c]):
+            out[c] = pd.to_numeric(out[c], errors="coerce")
+
+# file-name date patterns -> (year, month, day) group numbers
+_NAME_DATE_PATTERNS = [
+    (re.compile(r"(\d{4})-(\d{2})-(\d{2})"), (1, 2, 3)),   # YYYY-MM-DD
+    (re.compile(r"(\d{2})-(\d{2})-(\d{4})"), (3, 1, 2)),   # MM-DD-YYYY
+    (re.compile(r"(\d{4})(\d{2})(\d{2})"),   (1, 2, 3)),   # YYYYMMDD
+]
 
 def _infer_date_from_name(p: Path):
-    s = p.name
-    m = re.search(r"(\d{4})-(\d{2})-(\d{2})", s)     # YYYY-MM-DD
-    if m:
-        return pd.to_datetime(f"{m.group(1)}-{m.group(2)}-{m.group(3)}").date()
-    m = re.search(r"(\d{2})-(\d{2})-(\d{4})", s)     # MM-DD-YYYY
-    if m:
-        return pd.to_datetime(f"{m.group(3)}-{m.group(1)}-{m.group(2)}").date()
-    m = re.search(r"(\d{4})(\d{2})(\d{2})", s)       # YYYYMMDD
-    if m:
-        return pd.to_datetime(f"{m.group(1)}-{m.group(2)}-{m.group(3)}").date()
+    for rx, (y, m, d) in _NAME_DATE_PATTERNS:
+        hit = rx.search(p.name)
+        if hit:
+            return date(int(hit[y]), int(hit[m]), int(hit[d]))
     return None
 
-def _slug_symbol_from_name(name: str) -> str:
-    s = (name or "").strip()
-    s = re.sub(r"\s+", "_", s)              # spaces -> underscore
-    s = re.sub(r"[^A-Za-z0-9_]+", "", s)    # drop non-alnum/underscore
-    s = re.sub(r"_+", "_", s).strip("_")
-    return s.upper() if s else "UNKNOWN_FUND"
+_WS_RE        = re.compile(r"\s+")
+_NON_SLUG_RE  = re.compile(r"[^A-Za-z0-9_]+")
+_MULTI_UND_RE = re.compile(r"_+")
+
+def _slug_symbols(names: pd.Series) -> pd.Series:
+    """Fund name -> FUND_NAME symbol (spaces -> '_', drop non-alnum, collapse '_'); empty -> UNKNOWN_FUND. Vectorized."""
+    # object dtype keeps Python's re (Unicode \s, e.g. NBSP) rather than the Arrow regex engine
+    s = names.astype(object).fillna("").str.strip()
+    s = s.str.replace(_WS_RE, "_", regex=True)
+    s = s.str.replace(_NON_SLUG_RE, "", regex=True)
+    s = s.str.replace(_MULTI_UND_RE, "_", regex=True).str.strip("_").str.upper()
+    return s.mask(s == "", "UNKNOWN_FUND")
 
 def _vendor_route_from_path(p: Path):
     # Expect .../raw/<vendor>/<route>/file.csv ; route may be nested (join with '/')
@@ -70,23 +81,28 @@ def _vendor_route_from_path(p: Path):
     except ValueError:
         return "unknown", "unknown"
 
+_ACCT_ID_RE = re.compile(r"[A-Z0-9_]+")
+
 def _account_id_from(vendor: str, route: str):
     key = (vendor.lower(), route.lower())
     if key in ACCOUNT_ID_OVERRIDES:
         return ACCOUNT_ID_OVERRIDES[key]
     # If the route itself looks like an account_id, use it
-    import re
     cand = route.replace("/", "_").upper()
-    if re.fullmatch(r"[A-Z0-9_]+", cand):
+    if _ACCT_ID_RE.fullmatch(cand):
         return cand
     # fallback: vendor_route
     return (vendor + "_" + route.replace("/", "_")).upper()
 
 # CHASE PARSER
 
+CHASE_POSITION_COLS = frozenset({"Asset Class", "Ticker", "Description", "Quantity", "Price", "Value", "As of"})
+
 def parse_chase_positions(p: Path) -> pd.DataFrame:
     """Parse Chase brokerage positions export; trims footnotes."""
-    df = pd.read_csv(p, encoding="utf-8-sig")
+    # only the columns used below are parsed; text ids stay strings (no 123.0 tickers)
+    df = pd.read_csv(p, encoding="utf-8-sig", engine="c", usecols=lambda c: c in CHASE_POSITION_COLS,
+                     dtype={"Ticker": "string", "Description": "string"})
     # Trim at 'FOOTNOTES' sentinel if present
     if "Asset Class" in df.columns:
         idx = df.index[df["Asset Class"].astype(str).str.strip().str.upper() == "FOOTNOTES"]
@@ -95,7 +111,7 @@ def parse_chase_positions(p: Path) -> pd.DataFrame:
 
     for c in ("Quantity", "Price", "Value"):
         if c in df.columns:
-            df[c] = df[c].map(_num)
+            df[c] = _num_series(df[c])
 
     as_of = None
     if "As of" in df.columns and df["As of"].notna().any():
@@ -123,44 +139,57 @@ def parse_chase_positions(p: Path) -> pd.DataFrame:
         "price": pos.get("Price"),
         "market_value": pos.get("Value"),
         "description": pos.get("Description"),
-        "vendor": vendor,
-        "route": route,
     })
 
     # fill market_value if missing
     mv_missing = out["market_value"].isna()
     out.loc[mv_missing, "market_value"] = out.loc[mv_missing, "shares"] * out.loc[mv_missing, "price"]
 
-    # normalize CASH
-    is_cash = (out["symbol"].eq("CASH")) | (out["description"].astype(str).str.contains("SWEEP|CASH", case=False, na=False))
-    out.loc[is_cash & out["market_value"].notna(), "symbol"] = "CASH"
-    out.loc[is_cash & out["market_value"].notna(), "price"] = 1.0
-    out.loc[is_cash & out["market_value"].notna(), "shares"] = out.loc[is_cash, "market_value"]
+    # normalize CASH (one mask for all three columns; cash holds 1.0-priced "shares" = value)
+    mv = out["market_value"].to_numpy(dtype=float, na_value=np.nan)
+    is_cash = (out["symbol"].eq("CASH") | out["description"].astype(str).str.contains("SWEEP|CASH", case=False, na=False))
+    cash = is_cash.to_numpy(dtype=bool) & ~np.isnan(mv)
+    out.loc[cash, "symbol"] = "CASH"
+    out.loc[cash, "price"] = 1.0
+    out.loc[cash, "shares"] = mv[cash]
 
-    return out[["as_of_date","account_id","symbol","shares","price","market_value","vendor","route"]]
+    return out[["as_of_date","account_id","symbol","shares","price","market_value"]]
 
 # ALIGHT PARSER
 
-def parse_alight_positions(p: Path) -> pd.DataFrame:
+_COL_NORM_RE = re.compile(r"[^a-z0-9]")
+
+def _column_finder(df: pd.DataFrame, p: Path):
     """
-    Parse Alight 401k positions. Uses 'Fund Name' (slugged) as symbol.
-    Recognizes Closing Balance and other common headers.
+    find_col(candidates, required=False) over df's columns, compared in a search-friendly
+    form (lowercase, alnum only). Per token, in priority order: an exact normalized name wins,
+    else the first column containing the token (tolerant of variants). Columns that normalize
+    to the same name keep the first one.
     """
-    df = pd.read_csv(p, encoding="utf-8-sig")
-    # normalize column names into a search-friendly form
-    def norm(s): return re.sub(r"[^a-z0-9]", "", s.lower())
-
-    cols_norm = {c: norm(c) for c in df.columns}
+    cols_norm = {}
+    for c in df.columns:
+        cols_norm.setdefault(_COL_NORM_RE.sub("", str(c).lower()), c)
 
     def find_col(candidates, required=False):
-        # candidates = list of tokens to look for in normalized col names, in priority order
         for token in candidates:
-            for col, n in cols_norm.items():
-                if token in n:        # substring match (tolerant of variants)
-                    return col
+            if token in cols_norm:
+                return cols_norm[token]
+            col = next((orig for n, orig in cols_norm.items() if token in n), None)
+            if col is not None:
+                return col
         if required:
             raise ValueError(f"{p} missing required column like: {candidates}")
         return None
+    return find_col
+
+
+def parse_alight_positions(p: Path) -> pd.DataFrame:
+    """
+    Parse Alight 401k positions. Uses 'Fund Name' (slugged) as symbol.
+    Recognizes Closing Balance and other common headers.
+    """
+    df = pd.read_csv(p, encoding="utf-8-sig")
+    find_col = _column_finder(df, p)
 
     name_col  = find_col(["fundname","investmentoption","name"], required=True)
     # units/price are optional in many Alight exports
@@ -175,7 +204,7 @@ def parse_alight_positions(p: Path) -> pd.DataFrame:
     # parse numerics
     for c in [units_col, price_col, value_col]:
         if c:
-            df[c] = df[c].map(_num)
+            df[c] = _num_series(df[c])
 
     # as-of date
     asof_col = find_col(["asof","asofthe","effective"], required=False)
@@ -193,7 +222,7 @@ def parse_alight_positions(p: Path) -> pd.DataFrame:
 
     pos = df[df[name_col].notna()].copy()
     fund_name = pos[name_col].astype(str).str.strip()
-    symbol = fund_name.apply(_slug_symbol_from_name)
+    symbol = _slug_symbols(fund_name)
 
     shares = pos[units_col] if units_col in pos.columns else None
     price  = pos[price_col] if price_col in pos.columns else None
@@ -206,8 +235,6 @@ def parse_alight_positions(p: Path) -> pd.DataFrame:
         "shares": shares,
         "price": price,
         "market_value": value,
-        "vendor": vendor,
-        "route": route,
     })
 
     # If value missing but shares*price available, compute it
@@ -220,16 +247,14 @@ def parse_alight_positions(p: Path) -> pd.DataFrame:
     out.loc[unitless, "shares"] = out.loc[unitless, "market_value"]
     out.loc[unitless, "price"]  = 1.0
 
-    # final dtypes
-    out["shares"] = pd.to_numeric(out["shares"], errors="coerce")
-    out["price"]  = pd.to_numeric(out["price"], errors="coerce")
-    out["market_value"] = pd.to_numeric(out["market_value"], errors="coerce")
+    # final dtypes (only columns not already parsed to float, e.g. absent -> all None)
+    _coerce_float(out, ("shares", "price", "market_value"))
 
     # (optional) quick debug so you can see what columns were chosen
     print(f"[normalize/alight] file={p.name} name={name_col} units={units_col} "
           f"price={price_col} value={value_col} as_of={as_of}")
 
-    return out[["as_of_date","account_id","symbol","shares","price","market_value","vendor","route"]]
+    return out[["as_of_date","account_id","symbol","shares","price","market_value"]]
 
 # FIDELITY PARSER
 
@@ -239,18 +264,7 @@ def parse_fidelity_positions(p: Path) -> pd.DataFrame:
     Reads Quantity, Last Price (or similar), and Current Value (or similar).
     """
     df = pd.read_csv(p, encoding="utf-8-sig")
-
-    def norm(s): return re.sub(r"[^a-z0-9]", "", s.lower())
-    cols_norm = {c: norm(c) for c in df.columns}
-
-    def find_col(candidates, required=False):
-        for token in candidates:
-            for col, n in cols_norm.items():
-                if token in n:
-                    return col
-        if required:
-            raise ValueError(f"{p} missing required column like: {candidates}")
-        return None
+    find_col = _column_finder(df, p)
 
     # Name / symbol
     desc_col  = find_col(["description","investmentname","fundname","name"], required=True)
@@ -264,7 +278,7 @@ def parse_fidelity_positions(p: Path) -> pd.DataFrame:
     # Coerce numerics
     for c in [qty_col, price_col, value_col]:
         if c and c in df.columns:
-            df[c] = df[c].map(_num)
+            df[c] = _num_series(df[c])
 
     # As-of date
     asof_col = find_col(["asof","asofthe","effective","date"])
@@ -284,13 +298,6 @@ def parse_fidelity_positions(p: Path) -> pd.DataFrame:
     pos = df[df[desc_col].notna()].copy()
 
     # symbol: prefer actual Symbol col; else slug the description
-    def _slug_symbol_from_name(name: str) -> str:
-        s = (name or "").strip()
-        s = re.sub(r"\s+", "_", s)
-        s = re.sub(r"[^A-Za-z0-9_]+", "", s)
-        s = re.sub(r"_+", "_", s).strip("_")
-        return s.upper() if s else "UNKNOWN_FUND"
-
     symbol = (
         pos[sym_col].astype(str).str.strip().where(
             pos[sym_col].notna() & (pos[sym_col].astype(str).str.strip() != "")
@@ -298,7 +305,7 @@ def parse_fidelity_positions(p: Path) -> pd.DataFrame:
         if sym_col in pos.columns else None
     )
     if symbol is None or symbol.isna().all():
-        symbol = pos[desc_col].astype(str).map(_slug_symbol_from_name)
+        symbol = _slug_symbols(pos[desc_col].astype(str))
 
     shares = pos[qty_col] if qty_col in pos.columns else None
     price  = pos[price_col] if price_col in pos.columns else None
@@ -311,8 +318,6 @@ def parse_fidelity_positions(p: Path) -> pd.DataFrame:
         "shares": shares,
         "price": price,
         "market_value": value,
-        "vendor": vendor,
-        "route": route,
     })
 
     # Fill value if shares * price available
@@ -325,15 +330,13 @@ def parse_fidelity_positions(p: Path) -> pd.DataFrame:
     out.loc[unitless, "shares"] = out.loc[unitless, "market_value"]
     out.loc[unitless, "price"]  = 1.0
 
-    # Final types
-    out["shares"] = pd.to_numeric(out["shares"], errors="coerce")
-    out["price"]  = pd.to_numeric(out["price"], errors="coerce")
-    out["market_value"] = pd.to_numeric(out["market_value"], errors="coerce")
+    # final dtypes (only columns not already parsed to float, e.g. absent -> all None)
+    _coerce_float(out, ("shares", "price", "market_value"))
 
     # (optional) quick debug
     print(f"[normalize/fidelity] file={p.name} desc={desc_col} qty={qty_col} price={price_col} value={value_col} as_of={as_of}")
 
-    return out[["as_of_date","account_id","symbol","shares","price","market_value","vendor","route"]]
+    return out[["as_of_date","account_id","symbol","shares","price","market_value"]]
 
 # Register parsers here; more vendors later
 PARSERS = {
@@ -347,23 +350,61 @@ def pick_parser(p: Path):
     vendor, _ = _vendor_route_from_path(p)
     return PARSERS.get(vendor, parse_chase_positions)
 
+def _walk_files(root: Path, suffixes: tuple) -> list[str]:
+    """
+    Files under root whose name ends with one of suffixes, via one os.scandir walk
+    (skips dot-files/dirs like glob does, e.g. .sync folders). Sorted for a stable order.
+    """
+    out, stack = [], [str(root)]
+    while stack:
+        try:
+            it = os.scandir(stack.pop())
+        except OSError:
+            continue
+        with it:
+            for e in it:
+                if e.name.startswith("."):
+                    continue
+                if e.is_dir():
+                    stack.append(e.path)
+                elif e.name.lower().endswith(suffixes):
+                    out.append(e.path)
+    return sorted(out)
+
+def _parse_one(f: str) -> pd.DataFrame:
+    fp = Path(f)
+    return pick_parser(fp)(fp)
+
+def _parse_all(files: list) -> list:
+    """Parse files in worker processes (the parsers are CPU-bound pandas work); keeps order."""
+    if len(files) <= 1:
+        return [_parse_one(f) for f in files]
+    with ProcessPoolExecutor(max_workers=min(os.cpu_count() or 1, len(files))) as ex:
+        return list(ex.map(_parse_one, files))
+
 def normalize_all():
-    files = glob.glob(str(RAW_ROOT / "**" / "*-positions.csv"), recursive=True)
+    files = _walk_files(RAW_ROOT, ("-positions.csv",))
     if not files:
         print("No raw position files found."); return
 
-    all_rows = []
-    for f in files:
-        fp = Path(f)
-        df = pick_parser(fp)(fp)
-        all_rows.append(df)
+    all_rows = _parse_all(files)
 
     df_all = pd.concat(all_rows, ignore_index=True)
+    # vendor/route are per file: attached once after concat as categoricals indexed by each
+    # row's file, instead of every parser filling N copies of the same two strings
+    file_id = np.repeat(np.arange(len(files)), [len(d) for d in all_rows])
+    vendor_route = [_vendor_route_from_path(Path(f)) for f in files]
+    df_all["vendor"] = pd.Categorical([v for v, _ in vendor_route])[file_id]
+    df_all["route"] = pd.Categorical([r for _, r in vendor_route])[file_id]
+    # other low-cardinality text keys -> category so the groupbys hash int codes, not strings
+    for c in ("account_id", "symbol"):
+        df_all[c] = df_all[c].astype("category")
 
     # Collapse to symbol-level per (date, account, vendor, route)
     grp = df_all.groupby(
         ["as_of_date","account_id","vendor","route","symbol"],
         dropna=False,
+        observed=True,
         as_index=False
     ).agg(
         shares=("shares","sum"),
@@ -372,11 +413,14 @@ def normalize_all():
     grp["price"] = (grp["market_value"] / grp["shares"]).where(grp["shares"] > 0)
 
     # Write one canonical file per (date, vendor, route)
-    for (adate, vendor, route), df_part in grp.groupby(["as_of_date","vendor","route"]):
+    for (adate, vendor, route), df_part in grp.groupby(["as_of_date","vendor","route"], observed=True):
         out_dir = NORM_ROOT / vendor / route.replace("/", os.sep)
         out_dir.mkdir(parents=True, exist_ok=True)
         out_path = out_dir / f"positions_{adate}.csv"
-        df_part[["as_of_date","account_id","symbol","shares","price","market_value"]].to_csv(out_path, index=False)
+        part = df_part[["as_of_date","account_id","symbol","shares","price","market_value"]]
+        part.to_csv(out_path, index=False)
+        # columnar copy alongside (dictionary-encoded account_id/symbol, typed numerics)
+        part.to_parquet(out_path.with_suffix(".parquet"), engine="pyarrow", compression="zstd", index=False)
         print(f"Wrote {out_path} rows={len(df_part)}")
 
 if __name__ == "__main__":
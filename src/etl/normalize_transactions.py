@@ -4,28 +4,51 @@ Normalize raw bank & credit card transactions into canonical CSV:
   date, account_id, amount, description, category, memo, tags
 
 Input  : DATA_DIR/transactions/raw/<vendor>/<route>/*-transactions.(csv|xlsx)
-Output : DATA_DIR/transactions/normalized/<vendor>/<route>/transactions_<from>_to_<to>.csv
+Output : DATA_DIR/transactions/normalized/<vendor>/<route>/transactions_<from>_to_<to>.csv (+ .parquet copy)
 
 Notes
 -----
 * Dedupes within a batch AND against all existing normalized files for the same vendor/route.
   Dupe key = (date, account_id, amount, normalized_description).
-* Category is assigned by rules in rules/category_rules.csv (optional).
+* Each output CSV gets a <name>.keys.parquet sidecar holding its dupe keys, so later runs
+  don't re-parse history (a missing/older sidecar is rebuilt from the CSV).
+* normalized/<vendor>/<route>/.state.json records each raw file's (mtime, size); unchanged raw
+  files are not parsed again, since all their rows are already normalized or were dupes.
+  Removing or editing a normalized CSV invalidates the route's state. FORCE_NORMALIZE=1 parses everything.
+* Category is assigned by rules in rules/category_rules.csv (optional); plain-substring rules
+  are matched with one Aho-Corasick scan when pyahocorasick is installed, else with a
+  numba-compiled byte scan when numba is, else through the combined regex.
 * This version removes 'subcategory' entirely to align with the repo's schema change.
 """
 from __future__ import annotations
-import os, glob, re
+import os, glob, json, re
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from functools import lru_cache
 from pathlib import Path
 from typing import Optional, List, Dict
 
+import numpy as np
 import pandas as pd
+import pyarrow as pa
+import pyarrow.csv as pacsv
+import pyarrow.parquet as pq
+try:
+    import ahocorasick  # pyahocorasick: optional, plain-substring rules fall back to the combined regex
+    HAVE_AHOCORASICK = True
+except ImportError:
+    HAVE_AHOCORASICK = False
 from dotenv import load_dotenv
+from _kernels import HAVE_NUMBA, first_literal_match
 
 load_dotenv()
 DATA_DIR   = Path(os.getenv("DATA_DIR", r"C:\\Users\\jo136\\OneDrive\\FinanceData"))
 RAW_ROOT   = DATA_DIR / "transactions" / "raw"
 NORM_ROOT  = DATA_DIR / "transactions" / "normalized"
 
+# FORCE_NORMALIZE=1 ignores .state.json and parses every raw file
+FORCE_NORMALIZE = os.getenv("FORCE_NORMALIZE", "0") == "1"
+STATE_NAME = ".state.json"
+
 REPO_ROOT = Path(os.getenv("REPO_ROOT", Path(__file__).resolve().parents[2]))
 RULES_DIR = REPO_ROOT / "rules"
 
@@ -41,8 +64,13 @@ ACCOUNT_ID_OVERRIDES: Dict[tuple[str, str], str] = {
 }
 
 # ---------- helpers ----------
-STOPWORDS = {"inc","inc.","llc","llc.","co","co.","corp","corp.","ltd","ltd.","the","store","stores","company","companies"}
+STOPWORDS = frozenset({"inc","inc.","llc","llc.","co","co.","corp","corp.","ltd","ltd.","the","store","stores","company","companies"})
+_NORM_RE  = re.compile(r"[^a-z0-9]+")
+# whole-token stopwords; after _NORM_RE tokens are [a-z0-9] only, so the dotted variants never occur
+_STOP_RE  = re.compile(r"\b(?:" + "|".join(sorted(w for w in STOPWORDS if "." not in w)) + r")\b")
 
+# both cached: called for the same paths by normalize_all, pick_parser and the parser itself
+@lru_cache(maxsize=None)
 def _vendor_route_from_path(p: Path) -> tuple[str, str]:
     parts = [s.lower() for s in p.parts]
     try:
@@ -54,6 +82,7 @@ def _vendor_route_from_path(p: Path) -> tuple[str, str]:
     except ValueError:
         return "unknown", "unknown"
 
+@lru_cache(maxsize=None)
 def _account_id_from(vendor: str, route: str) -> str:
     key = (vendor.lower(), route.lower())
     if key in ACCOUNT_ID_OVERRIDES:
@@ -61,41 +90,53 @@ def _account_id_from(vendor: str, route: str) -> str:
     # default to the route name uppercased with slashes replaced
     return route.replace("/", "_").upper()
 
-def _num_amount(x) -> Optional[float]:
-    if pd.isna(x): return None
-    s = str(x).strip().replace(",", "").replace("$", "")
-    neg = s.startswith("(") and s.endswith(")")
-    s = s.strip("()").strip()
-    try:
-        v = float(s)
-        return -v if neg else v
-    except Exception:
-        return None
-
-def _normalize_merchant(text: str) -> str:
-    if not isinstance(text, str): return ""
-    t = re.sub(r"[^a-z0-9]+", " ", text.lower())
-    toks = [w for w in t.split() if w not in STOPWORDS]
-    return " ".join(toks).strip()
-
-def _coalesce(df: pd.DataFrame, candidates: List[str]) -> Optional[str]:
-    lower = {c.lower(): c for c in df.columns}
+def _num_amount(col: pd.Series) -> pd.Series:
+    """'$1,234.50' / '(12.00)' / 12.5 -> float (parentheses = negative); unparseable -> NaN. Vectorized."""
+    s = col.astype("string").str.strip().str.replace(",", "", regex=False).str.replace("$", "", regex=False)
+    neg = (s.str.startswith("(") & s.str.endswith(")")).fillna(False).astype(bool)
+    v = pd.to_numeric(s.str.strip("()").str.strip(), errors="coerce").astype(float)
+    return v.where(~neg, -v)
+
+def _normalize_merchant(desc: pd.Series) -> pd.Series:
+    """Lowercase, collapse non [a-z0-9] runs to a space, drop STOPWORDS tokens (vectorized .str ops)."""
+    t = desc.astype("string").fillna("").str.lower()
+    t = t.str.replace(_NORM_RE, " ", regex=True)
+    t = t.str.replace(_STOP_RE, " ", regex=True)
+    return t.str.replace(r"\s+", " ", regex=True).str.strip().astype(object)
+
+def _coalesce(index: tuple, candidates: List[str]) -> Optional[str]:
+    """First candidate present as-is, then case-insensitively, then as a substring of a column name.
+    index = (exact names, {lowercased: name}, [(name, lowercased)]) from _resolve_columns."""
+    exact, lower, pairs = index
     for cand in candidates:
-        if cand in df.columns: return cand
+        if cand in exact: return cand
         lc = cand.lower()
         if lc in lower: return lower[lc]
-    for col in df.columns:
+    for col, col_lc in pairs:
         for cand in candidates:
-            if cand.lower() in col.lower():
+            if cand.lower() in col_lc:
                 return col
     return None
 
-def _dupe_key_series(df: pd.DataFrame) -> pd.Series:
-    desc_norm = df["description"].fillna("").map(_normalize_merchant)
-    return (df["date"].astype(str) + "|" +
-            df["account_id"].astype(str) + "|" +
-            df["amount"].round(2).astype(str) + "|" +
-            desc_norm)
+def _resolve_columns(columns, roles: Dict[str, List[str]]) -> Dict[str, Optional[str]]:
+    """{role: candidate names} -> {role: column or None}; the lower-case index is built once per file."""
+    pairs = [(c, str(c).lower()) for c in columns]
+    index = (set(columns), {lc: c for c, lc in pairs}, pairs)
+    return {role: _coalesce(index, cands) for role, cands in roles.items()}
+
+def _dupe_keys(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Per-row dupe key as columns (date, account_id, amount rounded to cents, normalized description).
+    Kept columnar so duplicated()/MultiIndex lookups factorize each column in C and combine the
+    integer codes, instead of hashing a Python tuple per row.
+    """
+    desc_norm = df["merchant_norm"] if "merchant_norm" in df.columns else _normalize_merchant(df["description"])
+    return pd.DataFrame({
+        "date": df["date"].astype(str),
+        "account_id": df["account_id"].astype(str),
+        "amount": pd.to_numeric(df["amount"], errors="coerce").round(2),
+        "desc_norm": desc_norm.astype(object),
+    }, index=df.index)
 
 # ---------- rules (category only) ----------
 def _load_category_rules():
@@ -112,67 +153,216 @@ def _load_category_rules():
     df["account_id"]  = df.get("account_id", "").astype(str).str.strip().replace({"": None})
     return df.sort_values(["priority"]).reset_index(drop=True)
 
-def _apply_category_rules(df: pd.DataFrame, rules: pd.DataFrame) -> pd.DataFrame:
+# backreferences count groups across the whole combined pattern, so such rules stay standalone
+_BACKREF_RE = re.compile(r"\\[1-9]|\(\?P=")
+# a 'contains' pattern without these is a plain substring and can go into the Aho-Corasick automaton
+_REGEX_META_RE = re.compile(r"[.^$*+?{}\[\]\\|()]")
+
+def _rule_regex(items: list[tuple[int, str]], flags: int) -> re.Pattern:
+    """
+    One pattern for a run of rules: ^(?:(?=.*?pat0)(?P<r0>)|(?=.*?pat1)(?P<r1>)|...).
+    Alternatives are tried in order at position 0 and each one searches the whole string,
+    so the first rule (by priority) that matches anywhere wins; a plain pat0|pat1 alternation
+    would return the leftmost match instead. m.lastgroup names the winning rule.
+    """
+    alt = "|".join(f"(?=[\\s\\S]*?(?:{pat}))(?P<r{pos}>)" for pos, pat in items)
+    return re.compile(f"^(?:{alt})", flags)
+
+def _literal_automaton(items: list[tuple[int, str]]):
+    """Aho-Corasick automaton over lowercased literal patterns; each word maps to its best rule position."""
+    A = ahocorasick.Automaton()
+    for pos, word in items:
+        if word not in A:  # items are in priority order: the first rule for a word wins
+            A.add_word(word, pos)
+    A.make_automaton()
+    return A
+
+def _utf8_concat(strs) -> tuple[np.ndarray, np.ndarray]:
+    """Strings -> (concatenated UTF-8 bytes as uint8, offsets of len n + 1); non-strings become ''."""
+    enc = [s.encode() if isinstance(s, str) else b"" for s in strs]
+    offsets = np.zeros(len(enc) + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum([len(b) for b in enc])
+    return np.frombuffer(b"".join(enc), dtype=np.uint8), offsets
+
+class _LiteralScan:
+    """Lowercased literal patterns in priority order, matched by _kernels.first_literal_match."""
+    def __init__(self, items: list[tuple[int, str]]):
+        words: Dict[str, int] = {}
+        for pos, word in items:
+            words.setdefault(word, pos)  # the first rule for a word wins
+        self.pats, self.offsets = _utf8_concat(list(words))
+        self.pos = np.fromiter(words.values(), dtype=np.int64, count=len(words))
+
+    def hits(self, text: np.ndarray, none: int) -> np.ndarray:
+        buf, offsets = _utf8_concat([s.lower() if isinstance(s, str) else None for s in text])
+        return first_literal_match(buf, offsets, self.pats, self.offsets, self.pos, none)
+
+def _compile_or_keep(pat: str, flags: int):
+    """re.compile(pat, flags), or pat itself if it doesn't compile (str.contains then raises as before)."""
+    try:
+        return re.compile(pat, flags)
+    except re.error:
+        return pat
+
+# builder for literal-substring groups; None -> they go into the combined regex like any other rule
+_LITERAL_MATCHER = _literal_automaton if HAVE_AHOCORASICK else _LiteralScan if HAVE_NUMBA else None
+
+def _compile_category_rules(rules: pd.DataFrame) -> list[tuple]:
+    """
+    Group rules by (text column, sign, account_id) and compile each group into one matcher.
+    Returns [(column, sign, account_id, matcher, [(rule pos, pattern)])] where matcher is
+    - a combined regex (see _rule_regex),
+    - an Aho-Corasick automaton over the group's plain-substring rules (pyahocorasick, optional),
+    - a _LiteralScan over them instead when only numba is installed,
+    - or None: the rule could not be combined and is matched on its own (its pattern precompiled).
+    """
+    if rules is None or rules.empty:
+        return []
+    buckets: Dict[tuple, list] = {}
+    literals: Dict[tuple, list] = {}
+    for pos, r in enumerate(rules[["match_type", "pattern", "sign", "account_id"]].itertuples(index=False)):
+        raw = str(r.pattern)
+        if r.match_type in ("contains", "regex"):
+            col, pat = "description", raw      # 'contains' is a regex search too
+            literal = raw if r.match_type == "contains" and not _REGEX_META_RE.search(raw) else None
+        elif r.match_type == "merchant_norm":
+            col, pat = "merchant_norm", re.escape(raw.lower())
+            literal = raw.lower()
+        else:
+            continue
+        key = (col, r.sign, r.account_id)
+        if _LITERAL_MATCHER and literal:
+            # description rules are case-insensitive; merchant_norm text is lowercase already
+            literals.setdefault(key, []).append((pos, literal.lower()))
+        else:
+            buckets.setdefault(key, []).append((pos, pat))
+
+    groups = [(col, sign, acct, _LITERAL_MATCHER(items), items)
+              for (col, sign, acct), items in literals.items()]
+    for (col, sign, acct), items in buckets.items():
+        flags = re.IGNORECASE if col == "description" else 0
+        combined = [it for it in items if not _BACKREF_RE.search(it[1])]
+        if combined:
+            try:
+                groups.append((col, sign, acct, _rule_regex(combined, flags), combined))
+            except re.error:  # e.g. a global inline flag, which must lead the whole pattern
+                combined = []
+        groups += [(col, sign, acct, None, [(pos, _compile_or_keep(pat, flags))])
+                   for pos, pat in items if (pos, pat) not in combined]
+    # highest-priority groups first, so later groups see the fewest still-open rows
+    groups.sort(key=lambda g: g[4][0][0])
+    return groups
+
+def _apply_category_rules(df: pd.DataFrame, rules: pd.DataFrame, groups: list[tuple]) -> pd.DataFrame:
     if rules is None or rules.empty:
         return df
     df = df.copy()
-    df["merchant_norm"] = df["description"].apply(_normalize_merchant)
+    if "merchant_norm" not in df.columns:
+        df["merchant_norm"] = _normalize_merchant(df["description"])
     df["category"] = df.get("category", None)
-    remaining = pd.Series(True, index=df.index)
 
-    for _, r in rules.iterrows():
-        mtype, pat, sign, acct = r["match_type"], str(r["pattern"]), r["sign"], r["account_id"]
-        cat = r["category"]
-        mask = remaining.copy()
+    # filters and texts as plain numpy arrays, evaluated once for all groups
+    # account filter on category codes: upper-case the few distinct ids, compare ints per row
+    acct_cat = df["account_id"].astype(str).astype("category")
+    acct_codes = acct_cat.cat.codes.to_numpy()
+    acct_upper = acct_cat.cat.categories.str.upper()
+    amt_arr  = pd.to_numeric(df["amount"], errors="coerce").to_numpy(dtype=float, na_value=np.nan)
+    text_arr = {c: df[c].to_numpy(dtype=object) for c in ("description", "merchant_norm")}
+
+    # position (priority order) of the first matching rule per row; len(rules) = no match
+    none = len(rules)
+    best = np.full(len(df), none, dtype=np.int64)
+    for col, sign, acct, rx, items in groups:
+        # only rows still open to this group: a row already matched by a higher-priority
+        # rule (lower position) can't change, so the scanned subset shrinks as rules fire
+        mask = best > items[0][0]
         if acct:
-            mask &= (df["account_id"].astype(str).str.upper() == acct.upper())
+            mask &= np.isin(acct_codes, np.flatnonzero(acct_upper == acct.upper()))
         if sign == "positive":
-            mask &= (df["amount"] > 0)
+            mask &= amt_arr > 0
         elif sign == "negative":
-            mask &= (df["amount"] < 0)
-
-        if mtype == "contains":
-            mask &= df["description"].str.contains(pat, case=False, na=False)
-        elif mtype == "regex":
-            mask &= df["description"].str.contains(pat, flags=re.IGNORECASE, regex=True, na=False)
-        elif mtype == "merchant_norm":
-            mask &= df["merchant_norm"].str.contains(pat.lower(), na=False, regex=False)
-        else:
+            mask &= amt_arr < 0
+        idx = np.flatnonzero(mask)
+        if idx.size == 0:
             continue
+        text = text_arr[col][idx]
+        if isinstance(rx, re.Pattern):
+            hit = np.fromiter((int(m.lastgroup[1:]) if isinstance(s, str) and (m := rx.match(s)) else none
+                               for s in text), dtype=np.int64, count=idx.size)
+        elif isinstance(rx, _LiteralScan):
+            hit = rx.hits(text, none)
+        elif rx is not None:
+            # one linear scan per text; the lowest rule position among all words found wins
+            hit = np.fromiter((min((pos for _, pos in rx.iter(s.lower())), default=none) if isinstance(s, str) else none
+                               for s in text), dtype=np.int64, count=idx.size)
+        else:
+            pos, pat = items[0]
+            flags = 0 if isinstance(pat, re.Pattern) else re.IGNORECASE if col == "description" else 0
+            hit = np.where(pd.Series(text).str.contains(pat, flags=flags, regex=True, na=False).to_numpy(), pos, none)
+        best[idx] = np.minimum(best[idx], hit)
 
-        idx = df.index[mask]
-        df.loc[idx, "category"] = cat
-        remaining.loc[idx] = False
-
+    matched = best < none
+    df.loc[matched, "category"] = rules["category"].to_numpy()[best[matched]]
     return df.drop(columns=["merchant_norm"])
 
 # ---------- vendor parsers ----------
-def _read_any(p: Path) -> pd.DataFrame:
+def _read_any(p: Path, columns: Dict[str, List[str]],
+              text: tuple = ()) -> tuple[pd.DataFrame, Dict[str, Optional[str]]]:
+    """
+    Read a CSV/XLSX export and resolve `columns` ({role: candidate names}) against its header.
+    Returns (frame, {role: column or None}). For CSVs the header is probed first so only the
+    resolved columns are parsed (multi-threaded pyarrow reader, every column as text; amounts
+    and dates are converted by the caller). Rows pyarrow rejects (e.g. Chase's trailing comma
+    on data rows only) fall back to pandas with the `text` roles read as str.
+    Excel is read whole (the workbook is loaded either way).
+    """
     if p.suffix.lower() in {".xlsx", ".xls"}:
-        return pd.read_excel(p)
-    return pd.read_csv(p, encoding="utf-8-sig")  # default CSV
+        df = pd.read_excel(p)
+        return df, _resolve_columns(df.columns, columns)
+    header = pd.read_csv(p, encoding="utf-8-sig", nrows=0)
+    cols = _resolve_columns(header.columns, columns)
+    resolved = set(cols.values())
+    wanted = [c for c in header.columns if c in resolved]
+    try:
+        tbl = pacsv.read_csv(p, convert_options=pacsv.ConvertOptions(
+            include_columns=wanted,
+            column_types={c: pa.string() for c in wanted},
+            strings_can_be_null=True,  # blank cells -> NaN, as pandas would
+        ))
+        return tbl.to_pandas(), cols
+    except pa.ArrowInvalid:
+        pass
+    dtype = {cols[r]: str for r in text if cols.get(r)}
+    df = pd.read_csv(p, encoding="utf-8-sig", engine="c", usecols=lambda c: c in wanted, dtype=dtype)
+    return df, cols
+
+CHASE_COLUMNS: Dict[str, List[str]] = {
+    "date":   ["Date", "Posting Date", "Post Date", "Transaction Date"],
+    "desc":   ["Description", "Description 1", "Payee", "Name", "Details", "Merchant Name"],
+    "amount": ["Amount", "Amount (USD)", "Amount USD"],  # CC exports typically have Amount
+    "debit":  ["Debit", "Withdrawal", "Withdrawals"],    # bank-only sometimes
+    "credit": ["Credit", "Deposit", "Deposits"],         # bank-only sometimes
+    "cat":    ["Category", "Category Name"],             # may exist in card exports
+    "memo":   ["Memo", "Notes", "Note"],                 # optional
+}
 
 def parse_chase_generic(p: Path) -> pd.DataFrame:
     """Parse both Chase bank and Chase credit-card CSV/XLSX."""
-    df = _read_any(p)
+    df, cols = _read_any(p, CHASE_COLUMNS, text=("desc", "cat", "memo"))
 
-    date_col   = _coalesce(df, ["Date", "Posting Date", "Post Date", "Transaction Date"])
-    desc_col   = _coalesce(df, ["Description", "Description 1", "Payee", "Name", "Details", "Merchant Name"])
-    amt_col    = _coalesce(df, ["Amount", "Amount (USD)", "Amount USD"])  # CC exports typically have Amount
-    debit_col  = _coalesce(df, ["Debit", "Withdrawal", "Withdrawals"])    # bank-only sometimes
-    credit_col = _coalesce(df, ["Credit", "Deposit", "Deposits"])        # bank-only sometimes
-    cat_col    = _coalesce(df, ["Category", "Category Name"])              # may exist in card exports
-    memo_col   = _coalesce(df, ["Memo", "Notes", "Note"])                # optional
+    date_col, desc_col, amt_col = cols["date"], cols["desc"], cols["amount"]
+    debit_col, credit_col = cols["debit"], cols["credit"]
+    cat_col, memo_col = cols["cat"], cols["memo"]
 
     if not date_col or not desc_col:
         raise ValueError(f"{p} missing a recognizable Date/Description column")
 
     # Amount logic: prefer single Amount; otherwise compute credit-debit
     if amt_col:
-        amt = df[amt_col].map(_num_amount)
+        amt = _num_amount(df[amt_col])
     else:
-        debit  = df[debit_col].map(_num_amount)  if debit_col  else None
-        credit = df[credit_col].map(_num_amount) if credit_col else None
+        debit  = _num_amount(df[debit_col])  if debit_col  else None
+        credit = _num_amount(df[credit_col]) if credit_col else None
         if debit is None and credit is None:
             raise ValueError(f"{p} missing Amount or (Debit/Credit) columns")
         debit  = debit.fillna(0) if debit is not None else 0
@@ -182,7 +372,7 @@ def parse_chase_generic(p: Path) -> pd.DataFrame:
     out = pd.DataFrame({
         "date": pd.to_datetime(df[date_col], errors="coerce").dt.date,
         "description": df[desc_col].astype(str).str.strip(),
-        "amount": pd.to_numeric(amt, errors="coerce"),
+        "amount": amt,  # float already (_num_amount / credit - debit)
         "category": df[cat_col].astype(str).str.strip() if cat_col else None,
         "memo": df[memo_col].astype(str).str.strip() if memo_col else None,
         "tags": None,
@@ -191,7 +381,8 @@ def parse_chase_generic(p: Path) -> pd.DataFrame:
 
     vendor, route = _vendor_route_from_path(p)
     account_id = _account_id_from(vendor, route)
-    out.insert(1, "account_id", account_id)
+    # constant per file: a one-category categorical instead of N copies of the string
+    out.insert(1, "account_id", pd.Categorical.from_codes(np.zeros(len(out), dtype=np.int8), [account_id]))
     out["amount"] = out["amount"].fillna(0).round(2)
 
     return out[["date","account_id","amount","description","category","memo","tags"]]
@@ -206,37 +397,153 @@ def pick_parser(p: Path):
     return PARSERS.get(vendor, parse_chase_generic)
 
 # ---------- main ----------
-def _load_existing_dupe_keys(vendor: str, route: str) -> set[str]:
-    """Scan existing normalized files for vendor/route and build dupe-key set."""
-    root = NORM_ROOT / vendor / route.replace("/", os.sep)
-    if not root.exists():
-        return set()
-    keys: set[str] = set()
-    for f in glob.glob(str(root / "*.csv")):
+def _walk_files(root: Path, suffixes: tuple) -> list[str]:
+    """
+    Files under root whose name ends with one of suffixes, via one os.scandir walk
+    (skips dot-files/dirs like glob does, e.g. .sync folders). Sorted for a stable order.
+    """
+    out, stack = [], [str(root)]
+    while stack:
         try:
-            df = pd.read_csv(f, dtype={"amount": float})
-            if {"date","account_id","amount","description"} <= set(df.columns):
-                # rebuild keys exactly as we compute them for new rows
-                desc_norm = df["description"].fillna("").map(_normalize_merchant)
-                kk = (df["date"].astype(str) + "|" +
-                      df["account_id"].astype(str) + "|" +
-                      pd.to_numeric(df["amount"], errors="coerce").round(2).astype(str) + "|" +
-                      desc_norm)
-                keys.update(kk.tolist())
-        except Exception:
+            it = os.scandir(stack.pop())
+        except OSError:
             continue
-    return keys
+        with it:
+            for e in it:
+                if e.name.startswith("."):
+                    continue
+                if e.is_dir():
+                    stack.append(e.path)
+                elif e.name.lower().endswith(suffixes):
+                    out.append(e.path)
+    return sorted(out)
+
+def _parse_one(fp: Path) -> pd.DataFrame:
+    return pick_parser(fp)(fp)
+
+def _parse_all(paths: list) -> list:
+    """Parse raw files in worker processes (date/amount/text parsing is CPU-bound and holds the GIL); keeps order."""
+    if len(paths) <= 1:
+        return [_parse_one(p) for p in paths]
+    with ProcessPoolExecutor(max_workers=min(os.cpu_count() or 1, len(paths))) as ex:
+        return list(ex.map(_parse_one, paths))
+
+def _read_many(read, paths: list) -> list:
+    """Run read(path) over paths on a small thread pool (pandas' C CSV parser releases the GIL); keeps order.
+    Used for the light key-column reads of normalized files, where a process pool isn't worth the startup."""
+    if len(paths) <= 1:
+        return [read(p) for p in paths]
+    with ThreadPoolExecutor(max_workers=min(8, len(paths))) as ex:
+        return list(ex.map(read, paths))
+
+KEY_COLS = ["date","account_id","amount","description"]
+# normalized output columns, typed (fixed so streamed chunks share one Parquet schema)
+NORMALIZED_SCHEMA = pa.schema([
+    ("date", pa.date32()), ("account_id", pa.string()), ("amount", pa.float64()),
+    ("description", pa.string()), ("category", pa.string()), ("memo", pa.string()), ("tags", pa.string()),
+])
+KEY_FIELDS = ["date","account_id","amount","desc_norm"]  # _dupe_keys columns, as stored in the sidecars
+
+def _keys_sidecar(csv_path) -> Path:
+    """transactions_<from>_to_<to>.csv -> transactions_<from>_to_<to>.keys.parquet"""
+    return Path(csv_path).with_suffix(".keys.parquet")
+
+def _parquet_copy(csv_path) -> Path:
+    """transactions_<from>_to_<to>.csv -> transactions_<from>_to_<to>.parquet (full columnar copy)"""
+    return Path(csv_path).with_suffix(".parquet")
+
+def _fresh(side: Path, csv_path) -> bool:
+    """side exists and is not older than the CSV it was derived from."""
+    return side.exists() and side.stat().st_mtime_ns >= os.stat(csv_path).st_mtime_ns
+
+def _read_normalized(f: str) -> Optional[pd.DataFrame]:
+    # only the dupe-key columns; from the parquet copy when present, else the CSV
+    pq = _parquet_copy(f)
+    if _fresh(pq, f):
+        try:
+            return pd.read_parquet(pq, engine="pyarrow", columns=KEY_COLS)
+        except Exception:
+            pass
+    try:
+        return pd.read_csv(f, usecols=lambda c: c in KEY_COLS, dtype={"amount": float})
+    except Exception:
+        return None
+
+def _write_keys_sidecar(csv_path, keys: pd.DataFrame) -> None:
+    keys.to_parquet(_keys_sidecar(csv_path), engine="pyarrow", compression="zstd", index=False)
+
+def _read_sidecar(path: Path) -> pd.DataFrame:
+    return pd.read_parquet(path, engine="pyarrow", columns=KEY_FIELDS)
+
+def _load_existing_dupe_keys(vendor: str, route: str) -> pd.MultiIndex:
+    """
+    Dupe keys of the existing normalized files for vendor/route, as a MultiIndex for isin().
+    Keys come from each CSV's .keys.parquet sidecar; files without a fresh one (older runs,
+    hand-edited CSVs) are read once (parquet copy, else CSV) and get their sidecar backfilled.
+    """
+    root = NORM_ROOT / vendor / route.replace("/", os.sep)
+    parts: list[pd.DataFrame] = []
+    if root.exists():
+        fresh, stale = [], []
+        for f in glob.glob(str(root / "*.csv")):
+            (fresh if _fresh(_keys_sidecar(f), f) else stale).append(f)
+        parts += _read_many(_read_sidecar, [_keys_sidecar(f) for f in fresh])
+        stale = [(f, df) for f, df in zip(stale, _read_many(_read_normalized, stale))
+                 if df is not None and set(KEY_COLS) <= set(df.columns)]
+        if stale:
+            # one combined frame -> keys built (and descriptions normalized) in a single pass,
+            # exactly as we compute them for new rows
+            combined = _dupe_keys(pd.concat([df for _, df in stale], keys=range(len(stale))))
+            parts.append(combined)
+            for i, (f, _) in enumerate(stale):
+                _write_keys_sidecar(f, combined.loc[i])
+    if not parts:
+        return pd.MultiIndex.from_frame(_dupe_keys(pd.DataFrame(columns=KEY_COLS)))
+    return pd.MultiIndex.from_frame(pd.concat(parts, ignore_index=True)[KEY_FIELDS])
+
+def _file_sig(fp: Path) -> list[int]:
+    st = fp.stat()
+    return [st.st_mtime_ns, st.st_size]
+
+def _load_route_state(nested_dir: Path) -> dict:
+    """{"files": {raw path rel. to RAW_ROOT: [mtime_ns, size]}, "outputs": {normalized CSV name: [mtime_ns, size]}}"""
+    empty = {"files": {}, "outputs": {}}
+    if FORCE_NORMALIZE:
+        return empty
+    try:
+        state = json.loads((nested_dir / STATE_NAME).read_text())
+    except (OSError, ValueError):
+        return empty
+    # an output removed/edited since -> rows of "unchanged" files may be missing now; parse everything
+    for name, sig in state.get("outputs", {}).items():
+        out = nested_dir / name
+        if not out.exists() or _file_sig(out) != sig:
+            return empty
+    return state
+
+def _save_route_state(nested_dir: Path, group: list[Path]) -> None:
+    state = {"files": {fp.relative_to(RAW_ROOT).as_posix(): _file_sig(fp) for fp in group},
+             "outputs": {Path(f).name: _file_sig(Path(f)) for f in sorted(glob.glob(str(nested_dir / "*.csv")))}}
+    (nested_dir / STATE_NAME).write_text(json.dumps(state, indent=1))
 
 def normalize_all() -> None:
-    # pick both CSV and Excel sources
-    files = glob.glob(str(RAW_ROOT / "**" / "*-transactions.csv"), recursive=True)
-    files += glob.glob(str(RAW_ROOT / "**" / "*-transactions.xlsx"), recursive=True)
+    # pick both CSV and Excel sources (one walk; any *.csv is the fallback)
+    candidates = _walk_files(RAW_ROOT, (".csv", ".xlsx"))
+    files = [f for f in candidates if f.lower().endswith(("-transactions.csv", "-transactions.xlsx"))]
+    # an export saved both ways: the CSV is parsed anyway, so skip the (slow, zipped) workbook
+    # unless it was saved after the CSV
+    csvs = {f.lower(): f for f in files if f.lower().endswith(".csv")}
+    def _has_newer_csv(f: str) -> bool:
+        sib = csvs.get(f.lower()[:-len(".xlsx")] + ".csv")
+        return sib is not None and os.stat(sib).st_mtime_ns >= os.stat(f).st_mtime_ns
+    files = [f for f in files if not (f.lower().endswith(".xlsx") and _has_newer_csv(f))]
     if not files:
-        files = glob.glob(str(RAW_ROOT / "**" / "*.csv"), recursive=True)
+        files = [f for f in candidates if f.lower().endswith(".csv")]
     if not files:
         print(f"No raw transaction files found under {RAW_ROOT}"); return
 
     rules = _load_category_rules()
+    rule_groups = _compile_category_rules(rules)
 
     # group by vendor/route so we can dedupe against existing per route
     files = [Path(f) for f in files]
@@ -245,49 +552,91 @@ def normalize_all() -> None:
         v, r = _vendor_route_from_path(fp)
         by_route.setdefault((v,r), []).append(fp)
 
-    for (vendor, route), group in sorted(by_route.items()):
-        existing_keys = _load_existing_dupe_keys(vendor, route)
-        frames = []
-        for fp in group:
-            df = pick_parser(fp)(fp)
-            if df.empty:
-                print(f"[SKIP] {fp} -> no rows after parsing")
-                continue
-            frames.append(df)
-
-        if not frames:
-            continue
-
-        df = pd.concat(frames, ignore_index=True)
+    # raw files unchanged since the last run (per route .state.json) are not parsed again
+    todo = []
+    for (vendor, route), group in by_route.items():
+        seen_files = _load_route_state(NORM_ROOT / vendor / route.replace("/", os.sep))["files"]
+        todo += [fp for fp in group if seen_files.get(fp.relative_to(RAW_ROOT).as_posix()) != _file_sig(fp)]
 
-        # intra-batch dedupe
-        batch_keys = _dupe_key_series(df)
-        duped_mask = batch_keys.duplicated(keep="first")
-        if duped_mask.any():
-            df = df[~duped_mask]
+    # every changed raw file parsed up front in one process pool, then consumed per route
+    parsed = dict(zip(todo, _parse_all(todo)))
 
-        # cross-batch dedupe against normalized outputs
-        cross_mask = batch_keys.isin(existing_keys)
-        if cross_mask.any():
-            df = df[~cross_mask]
-
-        if df.empty:
+    for (vendor, route), all_files in sorted(by_route.items()):
+        nested_dir = NORM_ROOT / vendor / route.replace("/", os.sep)
+        nested_dir.mkdir(parents=True, exist_ok=True)
+        group = [fp for fp in all_files if fp in parsed]
+        if not group:
+            print(f"[normalize/tx] {vendor}/{route}: raw files unchanged; skipped")
+            continue
+        existing_keys = _load_existing_dupe_keys(vendor, route)
+        # streamed file by file into dot-named partials (skipped by the loaders' globs), renamed
+        # once the batch's date range is known -> no full-batch concat
+        part_csv = nested_dir / ".transactions_partial.csv"
+        part_pq = _parquet_copy(part_csv)
+        part_csv.unlink(missing_ok=True)
+        seen = None            # keys of every row met so far in this batch (intra-batch dedupe)
+        kept_keys = []
+        n_rows = classified = 0
+        dt_min = dt_max = None
+        any_rows = False
+        writer = None
+        try:
+            for fp in group:
+                df = parsed.pop(fp)
+                if df.empty:
+                    print(f"[SKIP] {fp} -> no rows after parsing")
+                    continue
+                any_rows = True
+                # normalized once; shared by the dupe keys and the merchant_norm category rules
+                df["merchant_norm"] = _normalize_merchant(df["description"])
+
+                # new = first in this file, not met in an earlier file, not in the normalized outputs
+                keys = _dupe_keys(df)
+                mi = pd.MultiIndex.from_frame(keys)
+                keep = ~keys.duplicated(keep="first").to_numpy() & ~mi.isin(existing_keys)
+                if seen is not None:
+                    keep &= ~mi.isin(seen)
+                seen = mi if seen is None else seen.append(mi)
+                df, keys = df[keep], keys[keep]
+                if df.empty:
+                    continue
+
+                # classify → CATEGORY ONLY
+                df = _apply_category_rules(df, rules, rule_groups).drop(columns=["merchant_norm"], errors="ignore")
+                df.to_csv(part_csv, mode="a", header=(n_rows == 0), index=False)
+                # columnar copy for typed reads (dictionary-encoded strings, no CSV tokenizing)
+                if writer is None:
+                    writer = pq.ParquetWriter(part_pq, NORMALIZED_SCHEMA, compression="zstd")
+                writer.write_table(pa.Table.from_pandas(df, schema=NORMALIZED_SCHEMA, preserve_index=False))
+                kept_keys.append(keys)
+                n_rows += len(df)
+                classified += int(df["category"].notna().sum())
+                lo, hi = df["date"].min(), df["date"].max()
+                dt_min = lo if dt_min is None else min(dt_min, lo)
+                dt_max = hi if dt_max is None else max(dt_max, hi)
+        finally:
+            if writer is not None:
+                writer.close()
+
+        if not any_rows:
+            _save_route_state(nested_dir, all_files)
+            continue
+        if n_rows == 0:
+            part_csv.unlink(missing_ok=True)
+            part_pq.unlink(missing_ok=True)
+            _save_route_state(nested_dir, all_files)
             print(f"[normalize/tx] {vendor}/{route}: nothing new after de-dupe")
             continue
-
-        # classify → CATEGORY ONLY
-        df = _apply_category_rules(df, rules)
-        classified = int(df["category"].notna().sum())
-        print(f"[normalize/tx] {vendor}/{route}: classified {classified}/{len(df)} rows (after de-dupe)")
+        print(f"[normalize/tx] {vendor}/{route}: classified {classified}/{n_rows} rows (after de-dupe)")
 
         # output
-        dt_min = df["date"].min()
-        dt_max = df["date"].max()
-        nested_dir = NORM_ROOT / vendor / route.replace("/", os.sep)
-        nested_dir.mkdir(parents=True, exist_ok=True)
         nested_path = nested_dir / f"transactions_{dt_min}_to_{dt_max}.csv"
-        df.to_csv(nested_path, index=False)
-        print(f"Wrote {nested_path}  rows={len(df)}")
+        os.replace(part_csv, nested_path)
+        os.replace(part_pq, _parquet_copy(nested_path))
+        # next run reads these keys instead of re-parsing this CSV
+        _write_keys_sidecar(nested_path, pd.concat(kept_keys))
+        _save_route_state(nested_dir, all_files)
+        print(f"Wrote {nested_path}  rows={n_rows}")
 
 if __name__ == "__main__":
     normalize_all()
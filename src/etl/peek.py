@@ -5,14 +5,9 @@ Run:
     python src/etl/peek.py
 """
 
-import os
-from pathlib import Path
-import duckdb
-from dotenv import load_dotenv
+from _db import DB_PATH, get_con
 
-load_dotenv()
-DB = Path(os.getenv("DATA_DIR", r"C:\Users\jo136\OneDrive\FinanceData")) / "finance.duckdb"
-print("DB path:", DB)
-with duckdb.connect(str(DB)) as con:
-    print(con.execute("SELECT COUNT(*) AS n FROM transactions").df())
-    print(con.execute("SELECT * FROM transactions ORDER BY date DESC LIMIT 5").df())
+print("DB path:", DB_PATH)
+con = get_con(read_only=True)
+print(con.execute("SELECT COUNT(*) AS n FROM transactions").df())
+print(con.execute("SELECT * FROM transactions ORDER BY date DESC LIMIT ?", [5]).df())
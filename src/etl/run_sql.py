@@ -1,7 +1,12 @@
 # run_sql.py
-import sys, duckdb, pathlib
+import sys, pathlib
 
-DB = r"C:\Users\jo136\OneDrive\FinanceData\finance.duckdb"
+from _db import get_con
+
+# statements that only read: opened read-only (no write lock, no WAL)
+READ_ONLY_PREFIXES = ("select", "describe", "show", "summarize", "explain")
+# rows per printed block: results are streamed in Arrow batches of this size, never held whole
+BATCH_ROWS = 10_000
 
 def main():
     if len(sys.argv) < 2:
@@ -17,16 +22,22 @@ def main():
         # Join all args so you can include spaces and semicolons
         sql = " ".join(sys.argv[1:])
 
-    con = duckdb.connect(DB)
-    try:
-        df = con.execute(sql).fetchdf()
-        # Pretty print; avoids PowerShell escaping headaches
+    con = get_con(read_only=sql.lstrip().lower().startswith(READ_ONLY_PREFIXES))
+    res = con.execute(sql)
+    # to_arrow_reader is the current name; fetch_record_batch (deprecated in DuckDB 1.4+) on older installs
+    to_reader = getattr(res, "to_arrow_reader", None) or res.fetch_record_batch
+    reader = to_reader(BATCH_ROWS)
+    printed = False
+    for batch in reader:
+        df = batch.to_pandas()
+        # Pretty print; avoids PowerShell escaping headaches. Header once; each block sizes its own columns
         try:
-            print(df.to_string(index=False))
+            print(df.to_string(index=False, header=not printed))
         except Exception:
             print(df)
-    finally:
-        con.close()
+        printed = True
+    if not printed:
+        print(reader.schema.empty_table().to_pandas())
 
 if __name__ == "__main__":
     main()
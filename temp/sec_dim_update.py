@@ -42,48 +42,38 @@ def main() -> None:
     # 2) Optionally sync from CSV into DB, by symbol (case-insensitive)
     if SECURITY_CSV.exists():
         print(f"Found CSV → syncing columns from: {SECURITY_CSV}")
-        # Create a temp view to read CSV with headers; we only care about the 3 columns.
-        # If CSV doesn’t include the new cols, the UPDATE will be a no-op.
+        # Read the CSV once into a temp table (a view can't take the path as a bound parameter);
+        # we only care about the 3 columns. If CSV doesn’t include the new cols, the UPDATE is skipped.
         con.execute("""
-            CREATE OR REPLACE TEMP VIEW v_sec_csv AS
+            CREATE OR REPLACE TEMP TABLE t_sec_raw AS
             SELECT *
             FROM read_csv_auto(?, HEADER=TRUE);
         """, [str(SECURITY_CSV)])
 
         # Sanity: check which columns are present
-        csv_cols = {r[0].lower() for r in con.execute("DESCRIBE v_sec_csv").fetchall()}
+        csv_cols = {r[0].lower() for r in con.execute("DESCRIBE t_sec_raw").fetchall()}
         need_cols = {"symbol", "dividend_yield", "qualified_ratio"}
         missing = need_cols - csv_cols
         if {"symbol"} - csv_cols:
             print("ERROR: CSV must contain a 'symbol' column to sync. Aborting CSV sync.")
         else:
-            # Build dynamic SET clause only for columns that exist in the CSV
-            set_clauses = []
-            if "dividend_yield" in csv_cols:
-                set_clauses.append("d.dividend_yield = c.dividend_yield")
-            if "qualified_ratio" in csv_cols:
-                set_clauses.append("d.qualified_ratio = c.qualified_ratio")
+            # Only the columns the CSV actually has; the symbol is lowered once on the CSV side
+            cols = [c for c in ("dividend_yield", "qualified_ratio") if c in csv_cols]
 
-            if set_clauses:
-                set_sql = ", ".join(set_clauses)
-                sql = f"""
+            if cols:
+                con.execute(f"""
+                    CREATE OR REPLACE TEMP TABLE t_sec_csv AS
+                    SELECT lower(symbol) AS symbol_lc, {", ".join(cols)}
+                    FROM t_sec_raw
+                """)
+                set_sql = ", ".join(f"{c} = c.{c}" for c in cols)
+                # UPDATE returns its row count
+                updated = con.execute(f"""
                     UPDATE security_dim AS d
                     SET {set_sql}
-                    FROM (
-                        SELECT
-                            symbol,
-                            { "dividend_yield," if "dividend_yield" in csv_cols else "" }
-                            { "qualified_ratio" if "qualified_ratio" in csv_cols else "" }
-                        FROM v_sec_csv
-                    ) AS c
-                    WHERE lower(d.symbol) = lower(c.symbol)
-                """
-                # Clean up potential trailing commas if only one column exists
-                sql = sql.replace("dividend_yield,\n                            \n", "dividend_yield\n")
-                sql = sql.replace(",,", ",")
-
-                con.execute(sql)
-                updated = con.execute("SELECT changes()").fetchone()[0]
+                    FROM t_sec_csv AS c
+                    WHERE lower(d.symbol) = c.symbol_lc
+                """).fetchone()[0]
                 print(f"Updated rows from CSV: {updated}")
             else:
                 print("CSV has no 'dividend_yield' or 'qualified_ratio' columns. Nothing to sync.")
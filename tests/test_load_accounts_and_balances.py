@@ -0,0 +1,84 @@
+"""
+Regression tests for src/etl/load_accounts_and_balances.py (run as a script, like the loaders are).
+
+Run:
+    python -m unittest discover -s tests
+"""
+from __future__ import annotations
+import os, subprocess, sys, tempfile, unittest
+from datetime import date
+from pathlib import Path
+
+import duckdb
+
+SCRIPT = Path(__file__).resolve().parents[1] / "src" / "etl" / "load_accounts_and_balances.py"
+
+
+def _run_loader(data_dir: Path) -> subprocess.CompletedProcess:
+    env = dict(os.environ, DATA_DIR=str(data_dir), DUCKDB_PATH=str(data_dir / "finance.duckdb"))
+    return subprocess.run([sys.executable, str(SCRIPT)], env=env, capture_output=True, text=True)
+
+
+class LoadBalancesTest(unittest.TestCase):
+    def setUp(self):
+        self._tmp = tempfile.TemporaryDirectory()
+        self.data_dir = Path(self._tmp.name)
+        (self.data_dir / "balances").mkdir()
+
+    def tearDown(self):
+        self._tmp.cleanup()
+
+    def _write(self, name: str, text: str) -> None:
+        (self.data_dir / "balances" / name).write_text(text, encoding="utf-8")
+
+    def _rows(self):
+        con = duckdb.connect(str(self.data_dir / "finance.duckdb"), read_only=True)
+        try:
+            return con.execute(
+                "SELECT as_of_date, account_id, balance_cents FROM balance_snapshot ORDER BY ALL").fetchall()
+        finally:
+            con.close()
+
+    def test_non_iso_dates(self):
+        self._write("balances.csv",
+                    "as_of_date,account_id,balance\n"
+                    "02/29/2024,CHECKING,100.50\n"
+                    "2024-03-31 00:00:00,CHECKING,200\n"
+                    "4/30/24,CHECKING,300\n")
+        res = _run_loader(self.data_dir)
+        self.assertEqual(res.returncode, 0, res.stderr)
+        self.assertEqual(self._rows(), [
+            (date(2024, 2, 29), "CHECKING", 10050),
+            (date(2024, 3, 31), "CHECKING", 20000),
+            (date(2024, 4, 30), "CHECKING", 30000),
+        ])
+
+    def test_unparseable_date_is_dropped_and_reported(self):
+        self._write("balances.csv",
+                    "as_of_date,account_id,balance\n"
+                    "2024-02-29,CHECKING,1\n"
+                    "not a date,CHECKING,2\n")
+        res = _run_loader(self.data_dir)
+        self.assertEqual(res.returncode, 0, res.stderr)
+        self.assertIn("unparseable as_of_date", res.stdout)
+        self.assertEqual(self._rows(), [(date(2024, 2, 29), "CHECKING", 100)])
+
+    def test_duplicate_key_within_file_fails(self):
+        self._write("balances.csv",
+                    "as_of_date,account_id,balance\n"
+                    "2024-02-29,CHECKING,1\n"
+                    "02/29/2024,CHECKING,2\n")
+        res = _run_loader(self.data_dir)
+        self.assertNotEqual(res.returncode, 0)
+        self.assertIn("duplicate (as_of_date, account_id)", res.stderr)
+
+    def test_later_file_wins(self):
+        self._write("a.csv", "as_of_date,account_id,balance\n2024-02-29,CHECKING,1\n")
+        self._write("b.csv", "as_of_date,account_id,balance\n02/29/2024,CHECKING,2\n")
+        res = _run_loader(self.data_dir)
+        self.assertEqual(res.returncode, 0, res.stderr)
+        self.assertEqual(self._rows(), [(date(2024, 2, 29), "CHECKING", 200)])
+
+
+if __name__ == "__main__":
+    unittest.main()